@@ -185,7 +185,10 @@ let s:pythonScriptDir = expand('<sfile>:p:h:h:h') . '/pythonx/conversion/'
 
 function! s:MyConvertHelper(command, ...) abort  "{{{2
     " Following function calls the conversion script given by a:command only if
-    " another conversion is not currently running.
+    " another conversion is not currently running. If a:2 is given, it is a
+    " Funcref called with the job and its exit status when the job exits, and
+    " the caller is responsible for not running conversions at once. Returns
+    " the job (or -1 if none was started).
     if !exists('s:pandocRunPID')
         " `s:pandocRunPID` is a dictionary used to keep track of all PIDs and
         " errorFlags for each buffer number. Its keys are the PIDs;
@@ -203,6 +206,7 @@ function! s:MyConvertHelper(command, ...) abort  "{{{2
         let s:pandocPdfApp = '/Applications/Skim.app'
     endif
     let l:auxCommand = a:0 == 0 ? '' : a:1
+    let l:OnExit = a:0 > 1 ? a:2 : v:null
     if empty(a:command)
         let l:command = b:pandoc_lastConversionMethod
     else
@@ -221,7 +225,7 @@ function! s:MyConvertHelper(command, ...) abort  "{{{2
     endif
     let l:buffer = bufnr('%')
     " l:pandoc_converting will be > 0 only if a conversion is ongoing.
-    if has_key(s:pandocRunBuf, l:buffer)
+    if has_key(s:pandocRunBuf, l:buffer) && !empty(s:pandocRunBuf[l:buffer])
         if has('nvim')
             let l:pandoc_converting = len(s:pandocRunBuf[l:buffer])
         elseif s:pandocRunBuf[l:buffer][0] =~# 'dead'
@@ -238,9 +242,11 @@ function! s:MyConvertHelper(command, ...) abort  "{{{2
         let l:pandoc_converting = 0
     endif
     " Don't change existing .tex file if currently in use
-    if l:pandoc_converting && (l:command ==# 'markdown-to-PDF-LaTeX.py' ||
-                    \ l:command ==# 'convert-to-markdown.py')
+    if l:pandoc_converting && l:OnExit is v:null &&
+                \ (l:command ==# 'markdown-to-PDF-LaTeX.py' ||
+                \ l:command ==# 'convert-to-markdown.py')
         call pandoc#conversion#DisplayError(0, 'Already converting...')
+        return -1
     else
         call setloclist(0, [])
         if has('nvim')
@@ -250,7 +256,11 @@ function! s:MyConvertHelper(command, ...) abort  "{{{2
                     \ l:auxCommand,
                     \ {'on_stdout': 'pandoc#conversion#DisplayMessages',
                     \ 'on_stderr': 'pandoc#conversion#DisplayError',
-                    \ 'on_exit': 'pandoc#conversion#EndProcess'})
+                    \ 'on_exit': l:OnExit is v:null
+                    \     ? 'pandoc#conversion#EndProcess'
+                    \     : {id, status, event ->
+                    \         [pandoc#conversion#EndProcess(id, status, event),
+                    \         l:OnExit(id, status)]}})
         else
             let l:jobPID = job_start('/usr/bin/env python3 ' .
                     \ s:pythonScriptDir . l:command .
@@ -258,7 +268,8 @@ function! s:MyConvertHelper(command, ...) abort  "{{{2
                     \ l:auxCommand,
                     \ {'out_cb': 'pandoc#conversion#DisplayMessages',
                     \ 'err_cb': 'pandoc#conversion#DisplayError',
-                    \ 'close_cb': 'pandoc#conversion#EndProcess'})
+                    \ 'close_cb': 'pandoc#conversion#EndProcess',
+                    \ 'exit_cb': l:OnExit is v:null ? {-> 0} : l:OnExit})
         endif
         let s:pandocRunPID[l:jobPID] = [l:buffer, bufwinid('%'), 0, []]
         if has_key(s:pandocRunBuf, l:buffer)
@@ -277,9 +288,122 @@ function! s:MyConvertHelper(command, ...) abort  "{{{2
         else
             call delete(l:serverFile)
         endif
+        return l:jobPID
     endif
 endfunction
 "2}}}
+function! s:AutoPDFState(buffer) abort  "{{{2
+    " `s:autoPDF` keeps track of automatic conversions for each buffer: the
+    " debounce timer, the running job, whether a newer save still needs
+    " converting, and statistics.
+    if !exists('s:autoPDF')
+        let s:autoPDF = {}
+    endif
+    if !has_key(s:autoPDF, a:buffer)
+        let s:autoPDF[a:buffer] = {'timer': -1, 'job': v:null, 'pending': 0,
+                    \ 'cancelling': 0, 'saveTime': [], 'buildSaveTime': [],
+                    \ 'buildStartTime': [], 'saves': 0, 'builds': 0,
+                    \ 'coalesced': 0, 'cancelled': 0, 'latency': 0.0}
+    endif
+    return s:autoPDF[a:buffer]
+endfunction
+"2}}}
+function! s:ScheduleAutoPDF() abort  "{{{2
+    " Called on every save while auto PDF is on. Rather than converting right
+    " away, wait until saves stop for `g:pandoc_autoPDFDelay` milliseconds,
+    " so that a burst of saves leads to one conversion of the last of them.
+    let l:buffer = bufnr('%')
+    let l:state = s:AutoPDFState(l:buffer)
+    let l:state.saves += 1
+    let l:state.saveTime = reltime()
+    if l:state.timer != -1
+        call timer_stop(l:state.timer)
+        let l:state.coalesced += 1
+    endif
+    let l:state.pending = 1
+    let l:state.timer = timer_start(get(g:, 'pandoc_autoPDFDelay', 500),
+                \ {-> s:RunAutoPDF(l:buffer)})
+endfunction
+"2}}}
+function! s:RunAutoPDF(buffer) abort  "{{{2
+    " Convert the buffer's latest save, unless a conversion is already
+    " running; then either stop that conversion (if
+    " `g:pandoc_autoPDFSupersede`, the default) or wait for it, and convert
+    " once it exits.
+    let l:state = s:AutoPDFState(a:buffer)
+    if l:state.timer != -1  " When called for BufEnter
+        call timer_stop(l:state.timer)
+        let l:state.timer = -1
+    endif
+    if !l:state.pending || !getbufvar(a:buffer, 'pandoc_autoPDFEnabled', 0)
+        return
+    endif
+    if l:state.job isnot v:null
+        if get(g:, 'pandoc_autoPDFSupersede', 1) && !l:state.cancelling
+            let l:state.cancelling = 1
+            let l:state.cancelled += 1
+            call pandoc#conversion#KillProcess(l:state.job, 'silent')
+        endif
+        return  " s:AutoPDFExited will start the next conversion
+    endif
+    if bufnr('%') != a:buffer
+        " Conversions work on the current buffer. If it isn't showing, wait
+        " for BufEnter.
+        if bufwinid(a:buffer) == -1
+            return
+        endif
+        let l:Start = function('s:StartAutoPDF', [a:buffer])
+        call win_execute(bufwinid(a:buffer), 'call l:Start()')
+    else
+        call s:StartAutoPDF(a:buffer)
+    endif
+endfunction
+"2}}}
+function! s:StartAutoPDF(buffer) abort  "{{{2
+    let l:state = s:AutoPDFState(a:buffer)
+    let l:state.pending = 0
+    let l:state.buildSaveTime = l:state.saveTime
+    let l:state.buildStartTime = reltime()
+    let l:job = s:MyConvertHelper('', '',
+                \ {job, status -> s:AutoPDFExited(a:buffer, status)})
+    let l:state.job = type(l:job) == v:t_number && l:job <= 0 ? v:null : l:job
+endfunction
+"2}}}
+function! s:AutoPDFExited(buffer, status) abort  "{{{2
+    let l:state = s:AutoPDFState(a:buffer)
+    let l:state.job = v:null
+    if l:state.cancelling
+        let l:state.cancelling = 0
+    elseif a:status == 0
+        let l:state.builds += 1
+        let l:latency = reltimefloat(reltime(l:state.buildSaveTime))
+        let l:state.latency += l:latency
+        echohl Comment
+        echom printf('Auto PDF: converted in %.1fs (%.1fs after save); ' .
+                    \ '%d saves, %d coalesced, %d superseded',
+                    \ reltimefloat(reltime(l:state.buildStartTime)),
+                    \ l:latency, l:state.saves, l:state.coalesced,
+                    \ l:state.cancelled)
+        echohl None
+    endif
+    " Convert any save that came in while this conversion was running.
+    if l:state.pending && l:state.timer == -1
+        call s:RunAutoPDF(a:buffer)
+    endif
+endfunction
+"2}}}
+function! pandoc#conversion#AutoPDFStats() abort  "{{{2
+    " Report what the auto PDF scheduler has done for the current buffer.
+    let l:state = s:AutoPDFState(bufnr('%'))
+    echo printf('Saves: %d; conversions: %d (mean %.1fs from save to PDF); ' .
+                \ 'coalesced saves: %d; superseded conversions: %d; ' .
+                \ 'waiting: %d; running: %s',
+                \ l:state.saves, l:state.builds,
+                \ l:state.builds ? l:state.latency / l:state.builds : 0.0,
+                \ l:state.coalesced, l:state.cancelled, l:state.pending,
+                \ l:state.job is v:null ? 'no' : 'yes')
+endfunction
+"2}}}
 function! pandoc#conversion#ToggleAutoPDF() abort  "{{{2
     " Following sets up autogroup to call .pdf conversion script when leaving
     " insert mode.
@@ -288,6 +412,13 @@ function! pandoc#conversion#ToggleAutoPDF() abort  "{{{2
         augroup AutoPDFConvert
             autocmd!
         augroup END
+        " Forget saves not yet converted.
+        let l:state = s:AutoPDFState(bufnr('%'))
+        if l:state.timer != -1
+            call timer_stop(l:state.timer)
+            let l:state.timer = -1
+        endif
+        let l:state.pending = 0
         echohl Comment
         redraw | echo 'Auto PDF Off...'
         echohl None
@@ -295,7 +426,8 @@ function! pandoc#conversion#ToggleAutoPDF() abort  "{{{2
         let b:pandoc_autoPDFEnabled = 1
         augroup AutoPDFConvert
             autocmd!
-            autocmd BufWritePost <buffer> :call <SID>MyConvertHelper('')
+            autocmd BufWritePost <buffer> :call <SID>ScheduleAutoPDF()
+            autocmd BufEnter <buffer> :call <SID>RunAutoPDF(bufnr('%'))
         augroup END
         echohl Comment
         redraw | echo 'Auto PDF On...'
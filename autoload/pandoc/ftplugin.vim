@@ -71,6 +71,43 @@ function! pandoc#ftplugin#JumpToHeader(mode, direction, count) abort  "{{{
     endif
 endfunction
 ""}}}
+" Path to plugin's python conversion folder (e.g.,
+" `~/.vim/plugged/vim-pandoc-mine/pythonx/conversion/`)
+let s:pythonScriptDir = expand('<sfile>:p:h:h:h') . '/pythonx/conversion/'
+" If `g:pandoc_jumpServer` is set, jumps to the .pdf or .tex file are handled
+" by `jump-server.py`, run as a job of this editor, instead of by a new python
+" process each time.
+let s:jumpServerName = 'Jump server'
+
+function! s:JumpServerRequest(method, args) abort  "{{{
+    " Call method of jump server, starting it if needed; returns v:null on
+    " failure
+    if empty(pandoc#server#Channel(s:jumpServerName))
+        call pandoc#server#StartJob(s:jumpServerName, ['/usr/bin/env',
+                    \ 'python3', s:pythonScriptDir . 'jump-server.py'])
+    endif
+    return pandoc#server#Request(s:jumpServerName, a:method, a:args)
+endfunction
+"}}}
+function! pandoc#ftplugin#JumpToPDF() abort  "{{{
+    " Show place in .pdf file corresponding to current line in Skim.app
+    if get(g:, 'pandoc_jumpServer', 0)
+        call s:JumpServerRequest('jumpToPdf', [expand('%:p'), line('.')])
+    elseif has('nvim')
+        call jobstart('/usr/bin/env python3 ' .
+                    \ s:pythonScriptDir . 'jump-to-line-in-Skim.py' .
+                    \ ' "' . expand('%:p') . '" ' . line('.') . ' pdf',
+                    \ {'on_stdout': 'pandoc#conversion#DisplayMessages',
+                    \ 'on_stderr': 'pandoc#conversion#DisplayError'})
+    else  " normal vim
+        call job_start('/usr/bin/env python3 ' .
+                    \ s:pythonScriptDir . 'jump-to-line-in-Skim.py' .
+                    \ ' "' . expand('%:p') . '" ' . line('.') . ' pdf',
+                    \ {'out_cb': 'pandoc#conversion#DisplayMessages',
+                    \ 'err_cb': 'pandoc#conversion#DisplayError'})
+    endif
+endfunction
+"}}}
 function! pandoc#ftplugin#JumpToTex(filetype) abort  "{{{
     let l:fileroot = expand('%:t:r')
     if l:fileroot ==# ''
@@ -79,7 +116,11 @@ function! pandoc#ftplugin#JumpToTex(filetype) abort  "{{{
     let l:filename = fnamemodify('~/tmp/pandoc/' . l:fileroot . a:filetype, ':p')
     if filereadable(l:filename)
         let l:linenum = '0'
-        if a:filetype ==# '\.tex'
+        if a:filetype ==# '.tex' && get(g:, 'pandoc_jumpServer', 0)
+            let l:linenum = s:JumpServerRequest('findTexLine',
+                        \ [expand('%:p'), line('.')])
+            let l:linenum = l:linenum is v:null ? '0' : l:linenum
+        elseif a:filetype ==# '.tex'
             let l:linenum = system('/usr/bin/env python3 ' .
                         \ s:pythonScriptDir . 'jump-to-line-in-Skim.py' .
                         \ ' "' . expand('%:p') . '" ' . line('.') . ' ' . a:filetype)
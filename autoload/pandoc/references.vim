@@ -35,7 +35,15 @@ function! s:JumpToReference(searchString) abort
         " citation is much faster, and probably accurate enough for most
         " purposes.
         "let l:biblio = system("echo '" . a:searchString . "' | pandoc --bibliography=$USER/Library/texmf/bibtex/bib/bibdatabase.bib --bibliography=$USER/Library/texmf/bibtex/bib/bibdatabase-helm.bib --filter=/usr/local/bin/pandoc-citeproc -t plain")
-        if !has('python3')  " use slower vimscript if python not available
+        let l:biblio = v:null
+        if !empty(get(g:, 'pandoc_bibServer', 0))
+            let l:biblio = s:BibServerRequest('constructOneEntry',
+                        \ [a:searchString])
+        endif
+        if type(l:biblio) == v:t_string && !empty(l:biblio)
+            " Found by bibliography server. (An empty reply may be a timeout,
+            " so fall back on looking it up here.)
+        elseif !has('python3')  " use slower vimscript if python not available
             let l:biblio = s:constructOneEntry(a:searchString)
         else  " python is faster
             if has('nvim')
@@ -184,20 +192,135 @@ function! s:FindHeaderID(base) abort
     return l:completionList
 endfunction
 
+" Path to bibliography server script. If `g:pandoc_bibServer` is set, the
+" server (rather than python or vimscript in this editor) is used to find
+" bibliographic entries. It is either 1 (server run as a job of this editor,
+" talking over stdin/stdout) or the address of a server shared between editors
+" ('unix:/path/to/socket' or 'localhost:port'), which is started if it isn't
+" already running.
+let s:bibServerScript = expand('<sfile>:p:h:h:h') .
+            \ '/pythonx/bibliography-server.py'
+let s:bibServerName = 'Bibliography server'
+
+function! s:BibServerChannel() abort
+    " Return channel to bibliography server, starting server if needed
+    let l:channel = pandoc#server#Channel(s:bibServerName)
+    if !empty(l:channel)
+        return l:channel
+    endif
+    let l:command = ['/usr/bin/env', 'python3', s:bibServerScript]
+    if type(g:pandoc_bibServer) == v:t_string  " Shared server
+        let l:channel = pandoc#server#Connect(s:bibServerName,
+                    \ g:pandoc_bibServer)
+        if empty(l:channel)
+            " Not running yet: start it (outliving this editor) and wait a
+            " moment for it to listen.
+            let l:command += ['--socket', g:pandoc_bibServer]
+            if has('nvim')
+                call jobstart(l:command, {'detach': v:true})
+            else
+                call job_start(l:command, {'stoponexit': '',
+                            \ 'in_io': 'null', 'out_io': 'null',
+                            \ 'err_io': 'null'})
+            endif
+            for l:i in range(10)
+                sleep 100m
+                let l:channel = pandoc#server#Connect(s:bibServerName,
+                            \ g:pandoc_bibServer)
+                if !empty(l:channel)
+                    break
+                endif
+            endfor
+        endif
+    else  " Server run as a job of this editor
+        let l:channel = pandoc#server#StartJob(s:bibServerName,
+                    \ l:command + ['--stdio'])
+    endif
+    return l:channel
+endfunction
+
+function! s:BibServerRequest(method, args) abort
+    " Call method of bibliography server; returns v:null on failure
+    if empty(s:BibServerChannel())
+        return v:null
+    endif
+    return pandoc#server#Request(s:bibServerName, a:method, a:args)
+endfunction
+
 function! s:GetBibEntries(base) abort
+    " Maximum number of (best-ranked) bibliographic matches to offer; 0 gives
+    " all matches, sorted by key.
+    let l:limit = get(g:, 'pandoc_bibMaxResults', 100)
+    " Allow misspellings in search words?
+    let l:fuzzy = get(g:, 'pandoc_bibFuzzy', 0)
+    if !empty(get(g:, 'pandoc_bibServer', 0))
+        let l:result = s:BibServerRequest('createBibList',
+                    \ [a:base, l:limit, l:fuzzy])
+        if type(l:result) == v:t_list
+            return l:result
+        endif
+    endif
     if !has('python3')  " use slower vimscript if python not available
         return s:createBibList(a:base)
     else  " python is faster
         if has('nvim')
             python3 import references
-            return py3eval("references.createBibList('" . a:base . "')")
+            return py3eval("references.createBibList('" . a:base . "', " .
+                        \ l:limit . ", " . l:fuzzy . ")")
         else
             pythonx import references
-            return pyxeval("references.createBibList('" . a:base . "')")
+            return pyxeval("references.createBibList('" . a:base . "', " .
+                        \ l:limit . ", " . l:fuzzy . ")")
         endif
     endif
 endfunction
 
+function! s:StartBibQuery(base) abort
+    " Start search for bibliographic entries. Returns {'id': ..., 'done': ...,
+    " 'words': [...]}; if 'done' is 0, 'words' holds only the results
+    " available so far, and the rest can be had by polling (see
+    " s:PollBibQuery). Searches run in the background only with python and
+    " timers, and unless `g:pandoc_bibAsync` is 0.
+    if !has('python3') || !has('timers') || !get(g:, 'pandoc_bibAsync', 1)
+                \ || !empty(get(g:, 'pandoc_bibServer', 0))
+        return {'id': 0, 'done': 1, 'words': <SID>GetBibEntries(a:base)}
+    endif
+    let l:limit = get(g:, 'pandoc_bibMaxResults', 100)
+    let l:fuzzy = get(g:, 'pandoc_bibFuzzy', 0)
+    if has('nvim')
+        python3 import references
+        return py3eval("references.submitBibQuery('" . a:base . "', " .
+                    \ l:limit . ", " . l:fuzzy . ")")
+    else
+        pythonx import references
+        return pyxeval("references.submitBibQuery('" . a:base . "', " .
+                    \ l:limit . ", " . l:fuzzy . ")")
+    endif
+endfunction
+
+function! s:PollBibQuery(timer) abort
+    " Update completion menu with results of background search
+    if has('nvim')
+        let l:reply = py3eval('references.pollBibQuery(' . s:bibQuery['id'] . ')')
+    else
+        let l:reply = pyxeval('references.pollBibQuery(' . s:bibQuery['id'] . ')')
+    endif
+    if l:reply['done']
+        call timer_stop(a:timer)
+    endif
+    " Give up if user has since left insert mode or moved elsewhere
+    if mode() !~# '^i' || line('.') != s:bibQuery['line']
+                \ || col('.') <= s:bibQuery['start']
+        call timer_stop(a:timer)
+        return
+    endif
+    if l:reply['words'] != s:bibQuery['words']
+        let s:bibQuery['words'] = l:reply['words']
+        call complete(s:bibQuery['start'] + 1,
+                    \ s:bibQuery['headers'] + l:reply['words'])
+    endif
+endfunction
+
 function! pandoc#references#MyCompletion(findstart, base) abort
     if a:findstart
         " locate the start of the partial ID but only if within 30 chars of
@@ -207,6 +330,7 @@ function! pandoc#references#MyCompletion(findstart, base) abort
         if l:line[:l:cursorPos - 1] =~# '@'
             let l:pos = searchpos('@', 'Wncb')
             if l:pos != [0,0] && l:cursorPos > l:pos[1] && l:pos[1] > l:cursorPos - 25
+                let s:completionStart = l:pos[1]
                 return l:pos[1]
             else
                 return -3
@@ -218,14 +342,25 @@ function! pandoc#references#MyCompletion(findstart, base) abort
         " Find matching header IDs...
         let l:completionList = <SID>FindHeaderID(a:base)
         " Add in bibliographic matches...
-        let l:bibMatches = <SID>GetBibEntries(a:base)
-        if len(l:bibMatches) == 1 && a:base == l:bibMatches[0]['word']
+        let l:query = <SID>StartBibQuery(a:base)
+        let l:bibMatches = l:query['words']
+        if exists('s:bibQueryTimer')
+            call timer_stop(s:bibQueryTimer)
+        endif
+        if !l:query['done']
+            " Offer what's available now, and refine it as the search
+            " finishes.
+            let s:bibQuery = {'id': l:query['id'], 'words': l:bibMatches,
+                        \ 'headers': l:completionList, 'line': line('.'),
+                        \ 'start': s:completionStart}
+            let s:bibQueryTimer = timer_start(50,
+                        \ function('s:PollBibQuery'), {'repeat': -1})
+        elseif len(l:bibMatches) == 1 && a:base == l:bibMatches[0]['word']
             " If it's the only match and it's already complete in the text,
             " don't pop-up a menu.
             return ''
         endif
-        let l:completionList += l:bibMatches
-        return {'words': l:completionList}
+        return {'words': l:completionList + l:bibMatches}
     endif
 endfunction
 
@@ -0,0 +1,116 @@
+scriptencoding utf-8
+" vim: set fdm=marker:
+" ============================================================================
+
+" Clients of the long-running python servers that answer requests over vim's
+" JSON channel protocol (see `pythonx/jsonChannel.py`): the bibliography
+" server and the jump server. Each server is known by a name (used in error
+" messages), and is started or connected to by its user.
+"
+" `s:servers` is a dictionary keyed on server name; its values are
+" dictionaries of 'channel', and (nvim only) 'replies' received (keyed on
+" request ID) and 'partial' line of reply.
+let s:servers = {}
+let s:requestId = 0
+
+function! s:OnData(name, channel, data, event) abort  "{{{
+    " Collect replies from server (nvim only)
+    if !has_key(s:servers, a:name) ||
+                \ s:servers[a:name]['channel'] != a:channel
+        return  " From a server since replaced
+    endif
+    let l:server = s:servers[a:name]
+    if a:data == ['']  " EOF: server has gone away
+        call remove(s:servers, a:name)
+        return
+    endif
+    let l:lines = copy(a:data)
+    let l:lines[0] = l:server['partial'] . l:lines[0]
+    let l:server['partial'] = remove(l:lines, -1)
+    for l:line in l:lines
+        if !empty(l:line)
+            let [l:id, l:result] = json_decode(l:line)
+            let l:server['replies'][l:id] = l:result
+        endif
+    endfor
+endfunction
+"}}}
+function! s:Register(name, channel) abort  "{{{
+    if !empty(a:channel)
+        let s:servers[a:name] = {'channel': a:channel, 'replies': {},
+                    \ 'partial': ''}
+    endif
+    return a:channel
+endfunction
+"}}}
+function! pandoc#server#Channel(name) abort  "{{{
+    " Return channel to server `a:name`, or 0 if it is not open
+    if has_key(s:servers, a:name) && (has('nvim') ||
+                \ ch_status(s:servers[a:name]['channel']) ==# 'open')
+        return s:servers[a:name]['channel']
+    endif
+    return 0
+endfunction
+"}}}
+function! pandoc#server#StartJob(name, command) abort  "{{{
+    " Start server `a:name` as a job of this editor, talking over
+    " stdin/stdout; returns its channel
+    if has('nvim')
+        let l:channel = jobstart(a:command,
+                    \ {'on_stdout': function('s:OnData', [a:name])})
+    else
+        let l:channel = job_getchannel(job_start(a:command,
+                    \ {'mode': 'json'}))
+    endif
+    return s:Register(a:name, l:channel)
+endfunction
+"}}}
+function! pandoc#server#Connect(name, address) abort  "{{{
+    " Connect to server `a:name` listening on `a:address` ('unix:/path' or
+    " 'host:port'); returns its channel, or 0 on failure
+    if has('nvim')
+        let l:mode = a:address =~# '^unix:' ? 'pipe' : 'tcp'
+        let l:address = substitute(a:address, '^unix:', '', '')
+        try
+            let l:channel = sockconnect(l:mode, expand(l:address),
+                        \ {'on_data': function('s:OnData', [a:name])})
+        catch
+            return 0
+        endtry
+    else
+        let l:channel = ch_open(a:address, {'mode': 'json', 'waittime': 100})
+        if ch_status(l:channel) !=# 'open'
+            return 0
+        endif
+    endif
+    return s:Register(a:name, l:channel)
+endfunction
+"}}}
+function! pandoc#server#Request(name, method, args) abort  "{{{
+    " Call method of server `a:name` (which must have been started or
+    " connected to); returns v:null on failure
+    let l:channel = pandoc#server#Channel(a:name)
+    if empty(l:channel)
+        return v:null
+    endif
+    let l:request = {'method': a:method, 'args': a:args}
+    if has('nvim')
+        let s:requestId += 1
+        let l:id = s:requestId
+        let l:replies = s:servers[a:name]['replies']
+        call chansend(l:channel, json_encode([l:id, l:request]) . "\n")
+        call wait(5000, {-> has_key(l:replies, l:id)})
+        let l:result = has_key(l:replies, l:id) ?
+                    \ remove(l:replies, l:id) : v:null
+    else
+        let l:result = ch_evalexpr(l:channel, l:request, {'timeout': 5000})
+    endif
+    if type(l:result) == v:t_dict && has_key(l:result, 'error')
+        echohl WarningMsg
+        echom a:name . ': ' . l:result['error']
+        echohl None
+        return v:null
+    endif
+    return l:result
+endfunction
+"}}}
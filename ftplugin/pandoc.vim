@@ -163,17 +163,7 @@ endif
 
 " Jump to corresponding line in Skim.app
 if executable("pandoc")
-    if has('nvim')
-        command! -buffer JumpToPDF call jobstart("/usr/bin/env python3 " .
-                    \ s:pythonScriptDir . 'jump-to-line-in-Skim.py' .
-                    \ ' "' . expand('%:p') . '" ' . line(".") . " pdf", {"on_stdout":
-                    \ "pandoc#conversion#DisplayMessages", "on_stderr": "pandoc#conversion#DisplayError"})
-    else  " normal vim
-        command! -buffer JumpToPDF call job_start("/usr/bin/env python3 " .
-                    \ s:pythonScriptDir . 'jump-to-line-in-Skim.py' .
-                    \ ' "' . expand('%:p') . '" ' . line(".") . " pdf", {"out_cb":
-                    \ "pandoc#conversion#DisplayMessages", "err_cb": "pandoc#conversion#DisplayError"})
-    endif
+    command! -buffer JumpToPDF call pandoc#ftplugin#JumpToPDF()
     nnoremap <buffer><silent> <LocalLeader>j :JumpToPDF<CR>
     inoremap <buffer><silent> <LocalLeader>j <C-o>:JumpToPDF<CR>
     " Open Dictionary.app with word under cursor
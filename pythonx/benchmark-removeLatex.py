@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+'''
+Micro-benchmark comparing `references.removeLatex` with the older multi-pass
+version (reproduced below as `legacyRemoveLatex`) over every field value of a
+.bib file. Call as:
+
+    benchmark-removeLatex.py [/path/to/file.bib] [repetitions]
+
+If no .bib file is given, the databases found by `references.findBibFiles`
+are used. The results of `references.removeLatex` are also checked against
+`EXPECTED`.
+'''
+
+from re import sub
+from sys import argv, exit
+from timeit import timeit
+import references
+
+# LaTeX, and what `references.removeLatex` should make of it
+EXPECTED = {r'\emph{Word and Object}': '*Word and Object*',
+            r'\textbf{Bold}': '**Bold**',
+            r'\mkbibquote{Quoted}': '"Quoted"',
+            r"G{\"o}del and Frege": 'Gödel and Frege',
+            r'\v{C}apek': 'Čapek',
+            r'Stra\ss e': 'Straße',
+            r'Hume \& Smith': 'Hume & Smith',
+            r'Wait\ldots{}': 'Wait...',
+            r'\textsc{Foo}': 'Foo',
+            r'See \url{http://example.com}': 'See http://example.com',
+            r'\emph{The \textsc{Tractatus}}': '*The Tractatus*'}
+
+
+def legacyRemoveLatex(text):
+    """Quick substitution of markdown for common LaTeX"""
+    text = sub(r'\\emph{([^}]*)}', r'*\1*', text)  # Swamp emphasis
+    text = sub(r'\\mkbibquote{([^}]*)}', r'"\1"', text)  # Remove mkbibquote
+    text = sub(r'{?\\ldots{?}?', '...', text)  # Replace `...`
+    text = sub(r"{\\'\\(.)}", r'\1', text)  # Replace latex accents
+    text = sub(r"\\['`\"^v]", '', text)  # Replace latex accents
+    text = sub(r'{(.)}', r'\1', text)  # Remove braces around single letters
+    text = text.replace('{}', '')  # Remove excess braces
+    text = text.replace("\\v", "")  # Remove 'v' accent
+    text = text.replace('\\&', '&')  # Don't escape `&`
+    return text
+
+
+def timeFunction(function, values, repetitions):
+    return timeit(lambda: [function(value) for value in values],
+                  number=repetitions) / repetitions
+
+
+bibFiles = argv[1:2] or references.findBibFiles()
+repetitions = int(argv[2]) if len(argv) > 2 else 5
+
+values = []
+for bibFile in bibFiles:
+    for bibItem in references.parseBibEntries(references.readFile(bibFile)):
+        values += bibItem['fields'].values()
+print('{} field values from {}'.format(len(values), ', '.join(bibFiles)))
+
+legacyTime = timeFunction(legacyRemoveLatex, values, repetitions)
+newTime = timeFunction(references.removeLatex, values, repetitions)
+print('legacy removeLatex:      {:8.1f} ms'.format(legacyTime * 1000))
+print('single-scan removeLatex: {:8.1f} ms'.format(newTime * 1000))
+print('speedup:                 {:8.1f}x'.format(legacyTime / newTime))
+changed = sum(1 for value in values
+              if legacyRemoveLatex(value) != references.removeLatex(value))
+print('{} values rendered differently (e.g., accents now kept as '
+      'unicode)'.format(changed))
+
+failures = 0
+for latex, expected in EXPECTED.items():
+    result = references.removeLatex(latex)
+    if result != expected:
+        print('{!r} became {!r}, not {!r}'.format(latex, result, expected))
+        failures += 1
+print('{} of {} expected renderings wrong'.format(failures, len(EXPECTED)))
+exit(1 if failures else 0)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+'''
+Long-running bibliography server. It keeps the parsed and indexed .bib
+databases from `references.py` in memory, checks the .bib files for changes
+in the background, and answers requests from vim. This gives editors without
+`+python3` the same fast completion, and lets several vim instances share one
+warm index. Call as:
+
+    bibliography-server.py --stdio
+    bibliography-server.py --socket ADDRESS
+
+With `--stdio`, requests are read from stdin and answered on stdout (for a
+vim job). With `--socket`, the server listens on ADDRESS, which is either
+`unix:/path/to/socket` or `host:port`.
+
+The protocol is vim's JSON channel protocol (see `jsonChannel.py`). The
+available methods are those in `METHODS`; their arguments are as in
+`references.py`.
+'''
+
+from os import path, remove
+from signal import signal, SIGTERM
+from socketserver import (StreamRequestHandler, ThreadingTCPServer,
+                          ThreadingUnixStreamServer)
+from sys import argv, exit, stdout
+from threading import Lock, Thread
+from time import sleep
+from jsonChannel import handleRequest, serveStdio
+import references
+
+WATCH_INTERVAL = 2  # Seconds between checks of .bib files for changes
+METHODS = {'createBibList': references.createBibList,
+           'constructOneEntry': references.constructOneEntry}
+
+# `references` keeps its state in module-level caches, so requests (and the
+# watcher) must take turns.
+referencesLock = Lock()
+
+
+def watchBibFiles():
+    """ Re-read .bib files as soon as they change, so that requests never
+    wait for parsing """
+    while True:
+        with referencesLock:
+            references.getBibData()
+        sleep(WATCH_INTERVAL)
+
+
+class RequestHandler(StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            reply = handleRequest(line.decode('utf-8'), METHODS,
+                                  referencesLock)
+            if reply:
+                self.wfile.write(reply.encode('utf-8'))
+                self.wfile.flush()
+
+
+def serveSocket(address):
+    if address.startswith('unix:'):
+        socketPath = path.expanduser(address[5:])
+        if path.exists(socketPath):
+            remove(socketPath)  # Left over from a server that was killed
+        server = ThreadingUnixStreamServer(socketPath, RequestHandler)
+    else:
+        host, port = address.rsplit(':', 1)
+        ThreadingTCPServer.allow_reuse_address = True
+        server = ThreadingTCPServer((host, int(port)), RequestHandler)
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if address.startswith('unix:'):
+            remove(socketPath)
+
+
+# Exit normally on SIGTERM so that the render cache is saved (via atexit)
+signal(SIGTERM, lambda signum, frame: exit(0))
+Thread(target=watchBibFiles, daemon=True).start()
+if len(argv) == 3 and argv[1] == '--socket':
+    serveSocket(argv[2])
+elif len(argv) == 1 or argv[1:] == ['--stdio']:
+    serveStdio(METHODS, referencesLock)
+else:
+    stdout.write(__doc__)
+    exit(1)
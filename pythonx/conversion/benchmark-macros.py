@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+'''
+Benchmark comparing `pandocConvert.preprocessFile` with the older version
+(reproduced below as `legacyPreprocessFile`), which scanned the text once per
+macro, as the number of macros grows. Call as:
+
+    benchmark-macros.py [/path/to/file.md] [repetitions]
+
+If no file is given, a book-sized text (about 2 MB) is generated. The
+results are also checked against the older version for `EQUIVALENCE_CASES`,
+and a macro that uses itself must raise an error rather than grow without
+end.
+'''
+
+from sys import argv, exit
+from timeit import timeit
+import pandocConvert
+
+MACRO_COUNTS = [1, 10, 100, 1000]
+PARAGRAPH = ('This is a paragraph of an imaginary book, with some math '
+             '($x^2 + y^2$), a macro ($macro0$), and another ($macro7$). ' * 4
+             + '\n\n')
+# (text, macros) for which the result must be as before, including macros
+# next to each other or to math
+EQUIVALENCE_CASES = [('$a$first$b$', {'a': 'A', 'b': 'B'}),
+                     ('$a$first$b$', {'first': 'F'}),
+                     ('$a$$b$', {'a': 'A', 'b': 'B'}),
+                     ('$x$ and $y$, $z$', {'y': 'Y'})]
+RECURSIVE_MACROS = {'loop': '($loop$)'}
+
+
+def legacyPreprocessFile(text, yamlData):
+    try:
+        macros = yamlData['macros'][0]
+        for key in macros:
+            text = text.replace('$' + str(key) + '$', str(macros[key]))
+    except KeyError:
+        pass  # No macros in file
+    return text
+
+
+def timeFunction(function, repetitions):
+    return timeit(function, number=repetitions) / repetitions
+
+
+if len(argv) > 1:
+    text = pandocConvert.readFile(argv[1])
+else:
+    text = PARAGRAPH * (2 * 1024 * 1024 // len(PARAGRAPH))
+repetitions = int(argv[2]) if len(argv) > 2 else 3
+failures = 0
+print('{:.1f} MB of text'.format(len(text) / 1024 / 1024))
+print('{:>7}  {:>10}  {:>12}'.format('macros', 'legacy', 'single-scan'))
+for macroCount in MACRO_COUNTS:
+    yamlData = {'macros': [{'macro' + str(number): 'replacement ' +
+                            str(number) for number in range(macroCount)}]}
+    legacyTime = timeFunction(lambda: legacyPreprocessFile(text, yamlData),
+                              repetitions)
+    newTime = timeFunction(lambda: pandocConvert.preprocessFile(
+        'benchmark', '.md', text, yamlData), repetitions)
+    if legacyPreprocessFile(text, yamlData) != \
+            pandocConvert.preprocessFile('benchmark', '.md', text, yamlData):
+        print('Results differ!')
+        failures += 1
+    print('{:>7}  {:>7.1f} ms  {:>9.1f} ms'.format(
+        macroCount, legacyTime * 1000, newTime * 1000))
+
+for caseText, macros in EQUIVALENCE_CASES:
+    yamlData = {'macros': [macros]}
+    legacyResult = legacyPreprocessFile(caseText, yamlData)
+    newResult = pandocConvert.preprocessFile('benchmark', '.md', caseText,
+                                             yamlData)
+    if legacyResult != newResult:
+        print('{!r} with {}: {!r}, not {!r}'.format(caseText, macros,
+                                                    newResult, legacyResult))
+        failures += 1
+try:
+    pandocConvert.preprocessFile('benchmark', '.md', 'A $loop$.',
+                                 {'macros': [RECURSIVE_MACROS]})
+    print('Macro using itself was not reported!')
+    failures += 1
+except pandocConvert.ConversionError as error:
+    print('Macro using itself reported: ' + str(error))
+print('{} of {} checks failed'.format(failures, len(EQUIVALENCE_CASES) +
+                                      len(MACRO_COUNTS) + 1))
+exit(1 if failures else 0)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+"""
+Build every markdown file in a project, in parallel, using pandocConvert.py.
+Call as (e.g.):
+
+    build-project.py [-j JOBS] [-f FORMAT] [-o DIR] [--mtime] [--force] \
+        ~/papers 'chapters/*.md'
+
+Each argument is a directory (searched recursively for markdown files) or a
+glob pattern. Files are built to FORMAT (one of the keys of
+`pandocConvert.formatOptions()`; `pdf` by default) in DIR (`~/tmp/pandoc`
+by default), at most JOBS (by default, the number of processors) at a time.
+
+A file is skipped if nothing affecting its output has changed since it was
+last built (see `pandocConvert.runConversion`). With `--mtime`, a file is
+skipped without even being read if its outputs are newer than it is. With
+`--force`, everything is rebuilt. At the end, a table of files, results, and
+times is printed, and the exit status is the number of failures.
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glob import glob
+from os import cpu_count, path, walk
+from time import time
+import pandocConvert
+
+MARKDOWN_EXTENSIONS = ('.md', '.markdown')
+
+
+def findFiles(patterns):
+    """
+    Return the markdown files in the given directories or matching the given
+    glob patterns
+    """
+    files = []
+    for pattern in patterns:
+        pattern = path.expanduser(pattern)
+        if path.isdir(pattern):
+            for directory, subdirectories, fileNames in walk(pattern):
+                subdirectories[:] = [subdirectory for subdirectory in
+                                     subdirectories
+                                     if not subdirectory.startswith('.')]
+                files += [path.join(directory, fileName)
+                          for fileName in fileNames]
+        else:
+            files += glob(pattern, recursive=True)
+    return sorted({path.abspath(file) for file in files
+                   if file.endswith(MARKDOWN_EXTENSIONS)})
+
+
+def isUpToDate(pandocTempDir, file, toFormat, toExtension):
+    """
+    Are all outputs of `file` newer than it?
+    """
+    baseFileName = path.splitext(path.basename(file))[0]
+    outputs = [baseFileName + toExtension]
+    if (toFormat == 'latex' and toExtension == '.tex') or \
+            toFormat == 'beamer':
+        outputs.append(baseFileName + '.pdf')
+    try:
+        return all(path.getmtime(path.join(pandocTempDir, output)) >=
+                   path.getmtime(file) for output in outputs)
+    except OSError:
+        return False
+
+
+def buildFile(pandocTempDir, file, options, useCache):
+    """
+    Build `file` (in a worker process). Returns 'built' or 'unchanged'.
+    """
+    document = pandocConvert.prepareDocument(pandocTempDir, file)
+    conversion = pandocConvert.prepareConversion(document, *options)
+    cacheHit = pandocConvert.runConversion(conversion, useCache, quiet=True,
+                                           openResult=False)
+    return 'unchanged' if cacheHit else 'built'
+
+
+def timeBuild(pandocTempDir, file, options, useCache):
+    startTime = time()
+    result = buildFile(pandocTempDir, file, options, useCache)
+    return result, time() - startTime
+
+
+def printSummary(results):
+    """
+    Print table of files, results, and times
+    """
+    width = max(len(file) for file in results)
+    pandocConvert.writeMessage('{:{}}  {:10}  {:>8}'.format(
+        'File', width, 'Result', 'Time'))
+    for file in sorted(results):
+        result, seconds = results[file]
+        pandocConvert.writeMessage('{:{}}  {:10}  {:>8}'.format(
+            file, width, result,
+            '' if seconds is None else '{:.1f} s'.format(seconds)))
+    counts = {}
+    for result, seconds in results.values():
+        counts[result] = counts.get(result, 0) + 1
+    pandocConvert.writeMessage(', '.join('{} {}'.format(count, result)
+                                         for result, count in
+                                         sorted(counts.items())))
+
+
+def buildProject(patterns, pandocTempDir, options, jobs, useMtime, force):
+    """
+    Build files found by `patterns` with `options` (a value of
+    `pandocConvert.formatOptions()`); returns the number of failures
+    """
+    toFormat, toExtension = options[:2]
+    results = {}
+    toBuild = []
+    baseFileNames = {}
+    for file in findFiles(patterns):
+        # All outputs go to pandocTempDir, named after the file.
+        baseFileName = path.splitext(path.basename(file))[0]
+        if baseFileName in baseFileNames:
+            pandocConvert.writeError('Error: ' + file + ' has the same ' +
+                                     'name as ' + baseFileNames[baseFileName])
+            results[file] = ('FAILED', None)
+            continue
+        baseFileNames[baseFileName] = file
+        if useMtime and not force and \
+                isUpToDate(pandocTempDir, file, toFormat, toExtension):
+            results[file] = ('up to date', None)
+        else:
+            toBuild.append(file)
+    if not results and not toBuild:
+        pandocConvert.writeError('No markdown files found.')
+        return 1
+
+    if toBuild:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(timeBuild, pandocTempDir, file,
+                                       options, not force): file
+                       for file in toBuild}
+            for future in as_completed(futures):
+                file = futures[future]
+                try:
+                    results[file] = future.result()
+                except Exception as error:  # Report, and let others finish
+                    pandocConvert.writeError('Error building ' + file + ': ' +
+                                             str(error))
+                    results[file] = ('FAILED', None)
+    printSummary(results)
+    return sum(1 for result, seconds in results.values()
+               if result == 'FAILED')
+
+
+# Builds run in separate processes, which (depending on the platform) may
+# import this script again; they must not start building themselves.
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Build all markdown files in ' +
+                            'directories or matching glob patterns.')
+    parser.add_argument('patterns', nargs='+', metavar='DIR_OR_GLOB')
+    parser.add_argument('-j', '--jobs', type=int, default=cpu_count(),
+                        help='number of files to build at once')
+    parser.add_argument('-f', '--format', default='pdf',
+                        help='format to build (a key of ' +
+                        'pandocConvert.formatOptions())')
+    parser.add_argument('-o', '--output', default='~/tmp/pandoc',
+                        help='directory for output files')
+    parser.add_argument('--mtime', action='store_true',
+                        help='skip files older than their outputs')
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild all files')
+    arguments = parser.parse_args()
+    # Checked only now, since finding the formats may need to run pandoc
+    formats = pandocConvert.formatOptions()
+    if arguments.format not in formats:
+        parser.error('unknown format: {} (use {})'.format(
+            arguments.format, ', '.join(sorted(formats))))
+    exit(buildProject(arguments.patterns, path.expanduser(arguments.output),
+                      formats[arguments.format], max(1, arguments.jobs),
+                      arguments.mtime, arguments.force))
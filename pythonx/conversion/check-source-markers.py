@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+'''
+Check that the source markers put in markdown converted to PDF via LaTeX (see
+`pandocConvert.addSourceMarkers`) change nothing but add LaTeX comments, and
+that the source map they make points at the right lines. Call as:
+
+    check-source-markers.py [/path/to/file.md]
+
+If no file is given, a sample with block quotes, lists, code, tables, raw
+LaTeX and macros that expand to several lines is used. The markdown is
+converted to LaTeX with pandoc with and without the markers, and the results
+compared with the markers taken out.
+'''
+
+from hashlib import sha256
+from os import getcwd, path
+from shutil import which
+from subprocess import run, PIPE
+from sys import argv, exit
+from tempfile import TemporaryDirectory
+import pandocConvert
+
+SAMPLE = '''---
+title: Sample
+macros:
+- short: a macro
+  long: "A macro of two paragraphs.\\n\\nIts second paragraph."
+---
+
+# A heading
+
+A paragraph with $short$.
+
+$long$
+
+A paragraph after a macro of several lines.
+
+> A block quote.
+
+> Its second paragraph, after a blank line.
+Lazily continued.
+
+> Another paragraph of it.
+>
+> And another.
+
+A paragraph between block quotes.
+
+> A second block quote.
+
+- A list item
+
+    with a second paragraph.
+
+1. A numbered item
+
+```
+Code
+
+with a blank line
+```
+
+\\begin{quote}
+Raw LaTeX.
+
+With a blank line.
+\\end{quote}
+
+| a | b |
+|---|---|
+| 1 | 2 |
+
+A last paragraph.
+'''
+PANDOC_COMMAND = ['pandoc', '--from=markdown-fancy_lists+smart',
+                  '--to=latex', '--wrap=none']
+
+
+def removeMarkers(latex):
+    '''
+    Take out the marker comments (and the blank lines they leave) from LaTeX
+    '''
+    lines = [line for line in latex.splitlines()
+             if not pandocConvert.SOURCE_MARKER_LINE.match(line)]
+    return '\n'.join(line for number, line in enumerate(lines)
+                     if line.strip() or
+                     (number > 0 and lines[number - 1].strip()))
+
+
+def toLatex(text):
+    return run(PANDOC_COMMAND, input=text.encode('utf-8'), stdout=PIPE,
+               check=True).stdout.decode('utf-8')
+
+
+if len(argv) > 1:
+    fileName = path.abspath(argv[1])
+    text = pandocConvert.readFile(fileName)
+else:
+    fileName = path.join(getcwd(), 'sample.md')
+    text = SAMPLE
+with TemporaryDirectory() as tempDir:
+    document = pandocConvert.prepareDocument(tempDir, fileName, text)
+    conversion = pandocConvert.prepareConversion(document, 'latex', '.tex', '',
+                                                 '', '', '')
+expanded = document['mdText']
+marked = conversion['mdText']
+sourceLines = conversion['sourceLines']
+failures = 0
+
+# Each marker must name the line it was put before, in the file as written.
+lines = text.splitlines()
+for name, lineNumber in sorted(sourceLines.items(), key=lambda item: item[1]):
+    line = lines[lineNumber - 1].strip() if lineNumber <= len(lines) else ''
+    if sha256(line.encode('utf-8')).hexdigest()[:12] != name.split('-')[0]:
+        print('Marker {} is not at line {}: {}'.format(name, lineNumber, line))
+        failures += 1
+print('{} markers checked against the source.'.format(len(sourceLines)))
+
+# Without the markers, the text must be as it was.
+unmarked = marked
+for name in sourceLines:
+    unmarked = unmarked.replace(
+        pandocConvert.SOURCE_MARKER_BLOCK.format(name), '', 1)
+if unmarked != expanded:
+    print('Markers change the markdown!')
+    failures += 1
+
+# So must pandoc's output.
+if which('pandoc'):
+    if removeMarkers(toLatex(marked)) != \
+            removeMarkers(toLatex(expanded)):
+        print('Markers change the LaTeX!')
+        failures += 1
+    else:
+        print('LaTeX is unchanged apart from the markers.')
+else:
+    print('pandoc not found; LaTeX not compared.')
+exit(1 if failures else 0)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+"""
+Read the YAML header ("front matter") of a markdown file. Only the start of
+the file is read, and the parsed header is cached -- in memory and on disk,
+keyed on the file's mtime and size -- so that every script asking about the
+same version of a file gets the same answer without parsing it again.
+
+A header starts with `---` on the first line and ends with `---` or `...`
+on a line of its own, as for pandoc.
+"""
+
+from hashlib import sha1
+from os import getpid, makedirs, path, replace, stat
+from pickle import dump, load, HIGHEST_PROTOCOL
+from re import compile
+try:
+    from ruamel.yaml import YAML
+    from ruamel.yaml.error import YAMLError
+except ImportError:  # Fall back on PyYAML
+    from yaml import safe_load, YAMLError
+    YAML = None
+
+CACHE_DIR = path.expanduser('~/.cache/vim-pandoc-mine/frontmatter')
+CACHE_VERSION = 1
+CHUNK_SIZE = 4096  # Bytes read at a time
+MAX_FRONT_MATTER_SIZE = 1024 * 1024  # Give up on headers longer than this
+FRONT_MATTER_START = compile(rb'---[ \t]*\r?\n')
+FRONT_MATTER_END = compile(rb'\n(?:---|\.\.\.)[ \t]*(?:\r?\n|$)')
+
+# Headers read by this process: {file name: (signature, header)}
+frontMatterCache = {}
+
+
+class FrontMatterError(Exception):
+    """
+    Raised when a YAML header cannot be parsed
+    """
+
+
+def findFrontMatter(fileName):
+    """
+    Return the text of the YAML header of `fileName` (without the `---`
+    lines), or None if there is none. Reads only as much of the file as
+    needed.
+    """
+    with open(fileName, 'rb') as f:
+        data = f.read(CHUNK_SIZE)
+        start = FRONT_MATTER_START.match(data)
+        if not start:
+            return None
+        while True:
+            # Look for the end from the opening line's newline, so that an
+            # empty header is found.
+            end = FRONT_MATTER_END.search(data, start.end() - 1)
+            # A match at the very end of what has been read may be cut off.
+            if end and (end.end() < len(data) or data.endswith(b'\n')):
+                break
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                if end:  # End of header is end of file
+                    break
+                return None  # Header never ends: not a header
+            if len(data) > MAX_FRONT_MATTER_SIZE:
+                return None
+            data += chunk
+    return data[start.end():end.start() + 1].decode('utf-8')
+
+
+def parseFrontMatter(text):
+    """
+    Parse YAML header text into a dictionary
+    """
+    text = text.replace('\t', '  ')  # Tabs are not allowed in YAML
+    try:
+        if YAML:
+            data = YAML(typ='safe').load(text)
+        else:
+            data = safe_load(text)
+    except YAMLError as error:
+        raise FrontMatterError(str(error))
+    if data is None:
+        return {}
+    if not isinstance(data, dict):
+        raise FrontMatterError('YAML header is not a mapping')
+    return data
+
+
+def readFrontMatterText(text):
+    """
+    Return the YAML header of markdown `text` (e.g., of a file that is not on
+    disk) as a dictionary, as `readFrontMatter` does for a file. Not cached.
+    """
+    data = text.encode('utf-8')
+    start = FRONT_MATTER_START.match(data)
+    if not start:
+        return {}
+    end = FRONT_MATTER_END.search(data, start.end() - 1)
+    if not end:
+        return {}
+    return parseFrontMatter(data[start.end():end.start() + 1].decode('utf-8'))
+
+
+def cacheFileName(fileName):
+    return path.join(CACHE_DIR,
+                     sha1(fileName.encode('utf-8')).hexdigest() + '.pickle')
+
+
+def loadCachedFrontMatter(fileName, signature):
+    try:
+        with open(cacheFileName(fileName), 'rb') as f:
+            cached = load(f)
+        if cached['version'] == CACHE_VERSION and \
+                cached['signature'] == signature:
+            return cached['header']
+    except Exception:  # Missing, corrupt, or out of date cache
+        pass
+    return None
+
+
+def saveCachedFrontMatter(fileName, signature, header):
+    try:
+        makedirs(CACHE_DIR, exist_ok=True)
+        cacheFile = cacheFileName(fileName)
+        tempFile = cacheFile + '.' + str(getpid())
+        with open(tempFile, 'wb') as f:
+            dump({'version': CACHE_VERSION, 'signature': signature,
+                  'header': header}, f, HIGHEST_PROTOCOL)
+        replace(tempFile, cacheFile)
+    except OSError:
+        pass  # Cache is only an optimization
+
+
+def readFrontMatter(fileName):
+    """
+    Return the YAML header of `fileName` as a dictionary (empty if there is
+    no header). Raises FrontMatterError if the header cannot be parsed. The
+    dictionary is shared with other callers, so should not be modified.
+    """
+    fileName = path.abspath(fileName)
+    fileStat = stat(fileName)
+    signature = (fileStat.st_mtime_ns, fileStat.st_size)
+    if fileName in frontMatterCache and \
+            frontMatterCache[fileName][0] == signature:
+        return frontMatterCache[fileName][1]
+    header = loadCachedFrontMatter(fileName, signature)
+    if header is None:
+        text = findFrontMatter(fileName)
+        header = {} if text is None else parseFrontMatter(text)
+        saveCachedFrontMatter(fileName, signature, header)
+    frontMatterCache[fileName] = (signature, header)
+    return header
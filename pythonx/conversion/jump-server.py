@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+
+'''
+Long-running server for jumping from a markdown file to the corresponding
+place in the .pdf or .tex file, run as a vim job. It keeps the YAML headers,
+.tex files, source maps and search patterns that `jumpToLine.py` reads in
+memory between jumps (re-reading any file whose mtime has changed), so that a
+jump needs neither a new python nor any parsing. Call as:
+
+    jump-server.py
+
+Requests are read from stdin and answered on stdout, with vim's JSON channel
+protocol (see `../jsonChannel.py`). The methods are those in `METHODS`,
+taking the markdown file and line number; both return the .tex line.
+'''
+
+import sys
+from os import path
+import jumpToLine
+# `jsonChannel.py` is shared with `bibliography-server.py`, a directory up.
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from jsonChannel import serveStdio  # noqa: E402
+
+METHODS = {'findTexLine': jumpToLine.findTexLine,
+           'jumpToPdf': jumpToLine.jumpToPdf}
+
+serveStdio(METHODS)
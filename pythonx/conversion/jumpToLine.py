@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+
+'''
+Find the line of the .tex file (in `~/tmp/pandoc/`) corresponding to a line
+of a markdown file, and show it in Skim.app. Used by `jump-to-line-in-Skim.py`
+(once per jump) and `jump-server.py` (which stays running, so that what is
+read here is kept from one jump to the next).
+
+Conversions to PDF via LaTeX leave a map from lines of the markdown to lines
+of the .tex file (see `pandocConvert.writeSourceMap`); the line is looked up
+there. If there is no map (or it is out of date), this falls back on
+converting the current paragraph and its neighbours into LaTeX (in one run of
+pandoc) and searching the .tex file for all of them at once; the place where
+the current paragraph is found with the most neighbours around it in the
+right order wins. Where the current paragraph itself cannot be found (e.g.,
+because of cross-references), a neighbour will do.
+
+Everything read from disk is cached, keyed on the mtime (and size) of the
+file it came from, so changed files are always read again.
+'''
+
+from bisect import bisect_right
+from functools import lru_cache
+from json import load
+from os import path, stat
+from re import compile, escape
+from subprocess import call, run, PIPE, DEVNULL
+from frontMatter import readFrontMatter
+
+TEMP_PATH = path.expanduser('~/tmp/pandoc/')
+PATH_TO_VIEWER = "/Applications/Skim.app"
+SOURCE_MAP_EXTENSION = '.texmap'  # As in pandocConvert.py
+# For searching the .tex file: how many blocks to convert on each side of the
+# current one, and how far apart (in lines per block) neighbours may be found
+WINDOW = 2
+NEARBY_LINES = 20
+BLOCK_SEPARATOR = 'vimpandocmineblock{}'
+MIN_PATTERN_LENGTH = 4
+LATEX_ENVIRONMENT = compile(r'\\(begin|end)\{[^}]*\}(\[[^]]*\])?')
+LATEX_FLEXIBLE = compile(r"``|''|\\(textcite|autocite)\{|"
+                         r'\\(part|chapter|(sub)*section|(sub)?paragraph)'
+                         r'\*?\{')
+
+# Files read: {file name: (signature, contents)}
+fileCache = {}
+
+
+def signature(fileName):
+    fileStat = stat(fileName)
+    return [fileStat.st_mtime_ns, fileStat.st_size]
+
+
+def readCached(fileName, reader):
+    '''
+    Return `reader(fileName)`, reusing the last result for this file if it
+    has not changed since
+    '''
+    fileSignature = signature(fileName)
+    if fileName in fileCache and fileCache[fileName][0] == fileSignature:
+        return fileCache[fileName][1]
+    contents = reader(fileName)
+    fileCache[fileName] = (fileSignature, contents)
+    return contents
+
+
+def readLines(fileName):
+    with open(fileName, 'r', encoding='utf-8') as f:
+        return f.read().splitlines()
+
+
+def readJson(fileName):
+    with open(fileName, 'r', encoding='utf-8') as f:
+        return load(f)
+
+
+def readSourceMap(texFile):
+    '''
+    Return the source map written with `texFile`, or None if there is none
+    or it was written for a different version of `texFile`
+    '''
+    try:
+        sourceMap = readCached(path.splitext(texFile)[0] +
+                               SOURCE_MAP_EXTENSION, readJson)
+        if sourceMap['signature'] == signature(texFile):
+            return sourceMap
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def lookUpLine(sourceMap, lineNumber):
+    '''
+    Return the .tex line for the block containing (1-based) markdown line
+    `lineNumber`, or None if it comes before all blocks in the map
+    '''
+    index = bisect_right(sourceMap['source'], lineNumber) - 1
+    return sourceMap['tex'][index] if index >= 0 else None
+
+
+def findBlocks(document, lineNumber):
+    '''
+    Return the blocks (paragraphs, headings, etc.) of the markdown `document`
+    (a list of lines) from WINDOW blocks before that at (0-based) line
+    `lineNumber` (or the next non-blank line) to WINDOW blocks after, and the
+    index of that block in the list
+    '''
+    blocks = []
+    current = None
+    block = []
+    start = 0
+    if document and document[0].rstrip() == '---':  # Skip YAML header
+        for number, line in enumerate(document[1:], 1):
+            if line.rstrip() in ('---', '...'):
+                start = number + 1
+                break
+    for number, line in enumerate(document[start:], start):
+        if line.strip():
+            block.append(line)
+            if current is None and number >= lineNumber:
+                current = len(blocks)
+        elif block:
+            blocks.append('\n'.join(block))
+            block = []
+            if current is not None and len(blocks) > current + WINDOW:
+                break
+    if block:
+        blocks.append('\n'.join(block))
+    if current is None:  # Nothing but blank lines after `lineNumber`
+        current = len(blocks) - 1
+    first = max(0, current - WINDOW)
+    return blocks[first:current + WINDOW + 1], current - first
+
+
+@lru_cache(maxsize=64)
+def renderBlocks(blocks, pandocOptions):
+    '''
+    Convert a tuple of markdown blocks to LaTeX in one run of pandoc,
+    returning a list of the LaTeX lines of each block
+    '''
+    separators = [BLOCK_SEPARATOR.format(number)
+                  for number in range(len(blocks))]
+    text = '\n\n'.join(separator + '\n\n' + block
+                       for separator, block in zip(separators, blocks))
+    output = run(['pandoc',
+                  '--from=markdown-fancy_lists',
+                  '--mathml',
+                  '--wrap=none',
+                  '--to=latex+smart',
+                  '--biblatex',
+                  '--lua-filter',
+                  'pandocCommentFilter.lua'
+                  ] +
+                 list(pandocOptions), input=text.encode('utf-8'), stdout=PIPE,
+                 stderr=DEVNULL).stdout.decode('utf-8')
+    rendered = []
+    for line in output.splitlines():
+        if line.strip() in separators:
+            rendered.append([])
+        elif rendered:
+            rendered[-1].append(line)
+    return rendered
+
+
+def linePattern(line):
+    '''
+    Return a regular expression matching a line of LaTeX from `renderBlocks`
+    as it would appear in the LaTeX of the whole document, or None if the line
+    is too short or too common to be worth looking for
+    '''
+    line = line.strip()
+    if len(line) < MIN_PATTERN_LENGTH or LATEX_ENVIRONMENT.fullmatch(line):
+        return None
+    pattern = ''
+    position = 0
+    for match in LATEX_FLEXIBLE.finditer(line):
+        pattern += escape(line[position:match.start()])
+        # Pandoc gives "``...''" for quotation marks here, where the whole
+        # document will likely have "\enquote{...}". It thinks
+        # cross-references are bibliographic citations, and so uses
+        # "\textcite{...}" or "\autocite{...}" rather than "\cref{...}". And
+        # it does not know whether a heading is a chapter or a section.
+        pattern += '.*' if match.group(0) in ('``', "''") else r'\\\w+\*?\{'
+        position = match.end()
+    return pattern + escape(line[position:])
+
+
+@lru_cache(maxsize=64)
+def blockMatcher(blocks, pandocOptions):
+    '''
+    Return one compiled pattern matching any line of the LaTeX of any of
+    `blocks`, with a named group for each line: `b<block>_<line>` (or None if
+    there is nothing to look for)
+    '''
+    patterns = []
+    for blockNumber, lines in enumerate(renderBlocks(blocks, pandocOptions)):
+        for number, line in enumerate(lines):
+            pattern = linePattern(line)
+            if pattern:
+                patterns.append('(?P<b{}_{}>{})'.format(
+                    blockNumber, number, pattern))
+    return compile('|'.join(patterns)) if patterns else None
+
+
+def searchLatex(file, texFile, lineNumber):
+    '''
+    Return the .tex line for (0-based) markdown line `lineNumber`, found by
+    converting its paragraph and its neighbours to LaTeX and searching the
+    .tex file for them in one pass
+    '''
+    document = readCached(file, readLines)
+
+    # Get info from YAML header. Need this to determine whether `draft: true`
+    # is set, which will effect what output is produced.
+    yamlHeader = readFrontMatter(file)
+    pandocOptions = []
+    if yamlHeader.get('draft'):
+        pandocOptions.append('--metadata=draft')
+    if yamlHeader.get('book'):
+        pandocOptions.append('--top-level-division=chapter')
+
+    blocks, current = findBlocks(document, lineNumber)
+    matcher = blockMatcher(tuple(blocks), tuple(pandocOptions))
+    if not matcher:
+        return 1
+
+    # Where each block is found: [(.tex line, offset from current block)]
+    found = []
+    for texLine, line in enumerate(readCached(texFile, readLines), 1):
+        match = matcher.search(line)
+        if match:
+            blockNumber = int(match.lastgroup[1:].split('_')[0])
+            found.append((texLine, blockNumber - current))
+
+    def score(candidate):
+        # Neighbours found nearby, on the right side of the candidate, count
+        # for it; being the current block itself counts most. Ties go to the
+        # earlier line.
+        texLine, offset = candidate
+        neighbours = sum(1 for otherLine, otherOffset in found
+                         if otherOffset != offset and
+                         0 < (otherLine - texLine) * (otherOffset - offset) and
+                         abs(otherLine - texLine) <= NEARBY_LINES *
+                         abs(otherOffset - offset))
+        return (offset == 0, neighbours, -abs(offset), -texLine)
+
+    if not found:
+        return 1
+    return max(found, key=score)[0]
+
+
+def latexFiles(file):
+    '''
+    Return the .tex and .pdf files produced from markdown `file`
+    '''
+    fileBase = path.splitext(path.basename(file))[0]
+    return (path.join(TEMP_PATH, fileBase + '.tex'),
+            path.join(TEMP_PATH, fileBase + '.pdf'))
+
+
+def findTexLine(file, lineNumber):
+    '''
+    Return the line of the .tex file corresponding to (1-based) line
+    `lineNumber` of markdown `file`
+    '''
+    texFile, pdfFile = latexFiles(file)
+    sourceMap = readSourceMap(texFile)
+    texLine = lookUpLine(sourceMap, lineNumber) if sourceMap else None
+    if texLine is None:
+        texLine = searchLatex(file, texFile, lineNumber - 1)
+    return texLine
+
+
+def jumpToPdf(file, lineNumber):
+    '''
+    Show the place in the .pdf file corresponding to (1-based) line
+    `lineNumber` of markdown `file` in Skim.app; returns the .tex line
+    '''
+    texFile, pdfFile = latexFiles(file)
+    texLine = findTexLine(file, lineNumber)
+    call([path.join(PATH_TO_VIEWER, 'Contents/SharedSupport/displayline'),
+          '-g', str(texLine), pdfFile, texFile])
+    return texLine
@@ -3,15 +3,36 @@
 """
 This script is designed to be run from within vim. It retrieves the filename
 (and complete path) of the current vim document, sets some options, and calls
-the pandocConvert.py script to complete the conversion. It repeats this with
-the version of the file checked in to git, computes a diff between them, and
-generates a .pdf of the result.
+the pandocConvert.py script to complete the conversion. It does the same with
+the version of the file checked in to git (at the same time, in another
+process), computes a diff between them, and generates a .pdf of the result.
+
+Each version is converted in a workspace of its own in
+`pandocTempDir/gitdiff/`. The workspace of a version from git is named after
+the git object holding it, so diffing against the same version again reuses
+its .tex file (see `pandocConvert.runConversion`), and only the working file
+is converted.
+
+With $PANDOC_DIFF_SECTIONS set to 1, the two .tex files are split at their
+top-level headings and the sections aligned, and latexdiff is run (in
+parallel) only on the sections that differ, with its output kept in
+`pandocTempDir/gitdiff/latexdiff/` (in a directory named after the file) for
+the next diff. Unchanged sections are copied as they are or, with
+$PANDOC_DIFF_SECTIONS set to 'collapse', reduced to their headings.
 """
 
 from sys import argv
-from os import chdir, path, remove
+from os import chdir, cpu_count, environ, path, listdir, makedirs, remove, \
+    utime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from difflib import SequenceMatcher
+from hashlib import sha256
+from re import compile, MULTILINE
+from shutil import rmtree
+from subprocess import check_output, call, CalledProcessError
+from tempfile import TemporaryDirectory
+from time import time
 import pandocConvert
-from subprocess import check_output, call
 
 toFormat = 'latexraw'
 toExtension = '.tex'
@@ -19,67 +40,251 @@ extraOptions = ''
 bookOptions = ''
 articleOptions = ''
 addedFilter = ''
+WORKSPACE_DIR = 'gitdiff'
+WORKING_WORKSPACE = 'working'
+MAX_WORKSPACE_AGE = 60 * 60 * 24 * 4  # Seconds to keep unused workspaces
+LATEXDIFF_COMMAND = ['latexdiff', '--type=FONTSTRIKE', '--subtype=COLOR']
+LATEXDIFF_CACHE = 'latexdiff'
+BEGIN_DOCUMENT = compile(r'^\\begin\{document\}.*\n?', MULTILINE)
+END_DOCUMENT = compile(r'^\\end\{document\}', MULTILINE)
+SECTION_LEVELS = ('part', 'chapter', 'section')
+SECTION_HEADING = compile(r'\\(' + '|'.join(SECTION_LEVELS) + r')\*?[\[{]')
+COLLAPSED_SECTION = '\\par\\emph{[Unchanged.]}\n\n'
+
+
+def convertToLatex(workspace, fileName, mdText=None):
+    """
+    Convert `fileName` (or `mdText`, as though it were `fileName`) to LaTeX in
+    `workspace` (in a worker process); returns the .tex file
+    """
+    document = pandocConvert.prepareDocument(workspace, fileName, mdText)
+    conversion = pandocConvert.prepareConversion(
+        document, toFormat, toExtension, extraOptions, bookOptions,
+        articleOptions, addedFilter)
+    pandocConvert.runConversion(conversion, quiet=True, openResult=False)
+    return conversion['artifacts'][0]
+
+
+def removeOldWorkspaces(workspaceRoot):
+    now = time()
+    for workspace in listdir(workspaceRoot):
+        workspace = path.join(workspaceRoot, workspace)
+        if now - path.getmtime(workspace) > MAX_WORKSPACE_AGE:
+            rmtree(workspace, ignore_errors=True)
+
+
+def splitLatex(texText):
+    """
+    Split a LaTeX document into its preamble (up to and including
+    `\\begin{document}`), its body, cut at each top-level heading (the
+    highest of `\\part`, `\\chapter` and `\\section` used), and its ending
+    (from `\\end{document}`). Returns None if the document has no body.
+    """
+    begin = BEGIN_DOCUMENT.search(texText)
+    end = END_DOCUMENT.search(texText, begin.end()) if begin else None
+    if not end:
+        return None
+    body = texText[begin.end():end.start()]
+    for level in SECTION_LEVELS:
+        heading = compile(r'^\\' + level + r'\*?[\[{]', MULTILINE)
+        starts = [match.start() for match in heading.finditer(body)]
+        if starts:
+            break
+    starts = [0] + [start for start in starts if start > 0] + [len(body)]
+    sections = [body[start:stop] for start, stop in zip(starts, starts[1:])]
+    return texText[:begin.end()], sections, texText[end.start():]
+
+
+def diffKey(oldText, newText):
+    return sha256((oldText + '\0' + newText).encode('utf-8')).hexdigest()
+
+
+def runLatexdiff(oldText, newText, cacheDir):
+    """
+    Return latexdiff's markup of the changes from `oldText` to `newText`
+    (complete documents or fragments), reusing the result of an earlier
+    diff of the same texts from `cacheDir`. Returns None if latexdiff fails.
+    """
+    diffFile = path.join(cacheDir, diffKey(oldText, newText) + '.tex')
+    try:
+        utime(diffFile)  # Mark as in use
+        return pandocConvert.readFile(diffFile)
+    except OSError:  # Not cached (or just removed by another diff)
+        pass
+    # The texts go elsewhere, where pruning the cache cannot touch them.
+    with TemporaryDirectory() as tempDir:
+        oldFile = path.join(tempDir, 'old.tex')
+        newFile = path.join(tempDir, 'new.tex')
+        pandocConvert.writeFile(oldFile, oldText)
+        pandocConvert.writeFile(newFile, newText)
+        try:
+            diffText = check_output(LATEXDIFF_COMMAND + [oldFile, newFile])\
+                .decode('utf-8')
+        except CalledProcessError:
+            return None
+    pandocConvert.writeFile(diffFile, diffText)
+    return diffText
+
+
+def diffBySection(oldTexText, newTexText, cacheDir, collapse=False):
+    """
+    Diff two LaTeX documents one top-level section at a time: sections are
+    aligned, latexdiff is run (in parallel) on each run of sections that
+    differ, and unchanged sections are copied as they are (or, if
+    `collapse`, reduced to their headings). Returns the diff .tex text, or
+    None if either document cannot be split into sections.
+    """
+    oldDocument = splitLatex(oldTexText)
+    newDocument = splitLatex(newTexText)
+    if not oldDocument or not newDocument:
+        return None
+    oldPreamble, oldSections, oldEnding = oldDocument
+    newPreamble, newSections, newEnding = newDocument
+    makedirs(cacheDir, exist_ok=True)
+    utime(cacheDir)  # Mark as in use
+
+    # The preamble is diffed (with an empty body) so that latexdiff adds the
+    # definitions of its markup to it.
+    jobs = [(oldPreamble + oldEnding, newPreamble + newEnding)]
+    pieces = []
+    matcher = SequenceMatcher(None, oldSections, newSections, autojunk=False)
+    for tag, oldStart, oldStop, newStart, newStop in matcher.get_opcodes():
+        if tag == 'equal':
+            for section in newSections[newStart:newStop]:
+                if collapse and SECTION_HEADING.match(section):
+                    heading = section.split('\n', 1)[0]
+                    pieces.append(heading + '\n\n' + COLLAPSED_SECTION)
+                else:
+                    pieces.append(section)
+        else:
+            pieces.append(len(jobs))
+            jobs.append((''.join(oldSections[oldStart:oldStop]),
+                         ''.join(newSections[newStart:newStop])))
+    pandocConvert.writeMessage(
+        'Running latexdiff on {} of {} sections'.format(
+            sum(1 for piece in pieces if isinstance(piece, int)),
+            len(pieces)))
+    with ThreadPoolExecutor(max_workers=cpu_count()) as executor:
+        diffs = list(executor.map(lambda job: runLatexdiff(*job, cacheDir),
+                                  jobs))
+
+    # Forget diffs of sections of this document that are no longer being
+    # compared
+    keep = {diffKey(oldText, newText) + '.tex' for oldText, newText in jobs}
+    for file in listdir(cacheDir):
+        if file not in keep:
+            try:
+                remove(path.join(cacheDir, file))
+            except OSError:  # Removed by another diff of this document
+                pass
+
+    preambleDiff = diffs[0] or ''
+    begin = BEGIN_DOCUMENT.search(preambleDiff)
+    end = END_DOCUMENT.search(preambleDiff, begin.end()) if begin else None
+    if not end:  # No markup definitions to be had
+        return None
+    body = ''
+    for piece in pieces:
+        if isinstance(piece, str):
+            body += piece
+        elif diffs[piece] is None:  # Show sections latexdiff fails on as new
+            pandocConvert.writeMessage('latexdiff failed on a section.')
+            body += jobs[piece][1]
+        else:
+            body += diffs[piece]
+    return preambleDiff[:begin.end()] + body + preambleDiff[end.start():]
+
+
+def diffWithGit(currentFileName, pandocTempDir, gitObject):
+    currentFilePath, currentFileShortName = path.split(currentFileName)
+    chdir(currentFilePath)
+    gitPrefix = check_output(['git', 'rev-parse',
+                              '--show-prefix']).decode('utf-8')[:-2]
+    # The git object (blob) holding the old version of the file; with an
+    # empty `gitObject`, the version in the git cache (index)
+    oldObject = check_output(['git', 'rev-parse', gitObject + ':' +
+                              path.join(gitPrefix, currentFileShortName)])\
+        .decode('utf-8').strip()
+    workspaceRoot = path.join(pandocTempDir, WORKSPACE_DIR)
+    oldWorkspace = path.join(workspaceRoot, oldObject)
+    newWorkspace = path.join(workspaceRoot, WORKING_WORKSPACE)
+    for workspace in (oldWorkspace, newWorkspace):
+        makedirs(workspace, exist_ok=True)
+        utime(workspace)  # Mark as in use
+    removeOldWorkspaces(workspaceRoot)
+
+    # Create .tex files of file in git cache and of current working file, at
+    # the same time. The old file is sent to pandoc as it comes from git,
+    # without being written to disk.
+    pandocConvert.writeMessage('Creating .tex of working file and of ' +
+                               'file in git cache...')
+    oldFileText = check_output(['git', 'cat-file', 'blob', oldObject])\
+        .decode('utf-8')
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        oldTex = executor.submit(convertToLatex, oldWorkspace,
+                                 currentFileName, oldFileText)
+        newTex = executor.submit(convertToLatex, newWorkspace,
+                                 currentFileName)
+        try:
+            oldTexName = oldTex.result()
+            newTexName = newTex.result()
+        except pandocConvert.ConversionError as error:
+            pandocConvert.writeError(str(error))
+            return 1
+
+    # Create texdiff file
+    pandocConvert.writeMessage('Creating latexdiff...')
+    currentFileBaseName, null = path.splitext(currentFileShortName)
+    diffTexName = path.join(pandocTempDir, currentFileBaseName + '.tex')
+    diffContents = None
+    sectionMode = environ.get('PANDOC_DIFF_SECTIONS', '0')
+    if sectionMode not in ('', '0'):
+        # Each document's sections are cached apart from others'.
+        latexdiffRoot = path.join(workspaceRoot, LATEXDIFF_CACHE)
+        makedirs(latexdiffRoot, exist_ok=True)
+        utime(latexdiffRoot)  # Mark as in use
+        removeOldWorkspaces(latexdiffRoot)
+        diffContents = diffBySection(
+            pandocConvert.readFile(oldTexName),
+            pandocConvert.readFile(newTexName),
+            path.join(latexdiffRoot, currentFileBaseName),
+            collapse=(sectionMode == 'collapse'))
+    if diffContents is None:
+        diffContents = check_output(LATEXDIFF_COMMAND +
+                                    [oldTexName, newTexName]).decode('utf-8')
+    pandocConvert.writeFile(diffTexName, diffContents)
+    # The .tex and .pdf are no longer those of any ordinary conversion.
+    for extension in ('.tex', '.pdf'):
+        hashFile = path.join(pandocTempDir, currentFileBaseName + extension +
+                             pandocConvert.BUILD_HASH_EXTENSION)
+        if path.exists(hashFile):
+            remove(hashFile)
+
+    # Convert to PDF
+    pandocConvert.writeMessage('Converting to .pdf...')
+    # Note: The `False` below is `bookFlag`, which is used in runLatex to
+    # determine whether makeidx will be run, and so to set an enviroment flag
+    # accordingly. Setting it False here will preserve security, when I don't
+    # care whether the index is being produced.
+    latexError = pandocConvert.runLatex(pandocTempDir, currentFileBaseName,
+                                        '-pdf', False)
+    if latexError:
+        pandocConvert.writeError('Error running LaTeX.')
+        return 1
+    endFile = currentFileBaseName + '.pdf'
+    if path.exists('/Applications/Skim.app'):
+        call(['open', '-a', '/Applications/Skim.app', '-g',
+              path.join(pandocTempDir, endFile)])
+    if path.exists('/System/Library/Sounds/Morse.aiff'):
+        call(['afplay', '/System/Library/Sounds/Morse.aiff'])
+    pandocConvert.writeMessage('Conversion complete.')
+    return 0
 
 
-# Get old file in git repository to diff with
-currentFileName = argv[1].strip('"')
-currentFilePath, currentFileShortName = path.split(currentFileName)
-chdir(currentFilePath)
-pandocTempDir = path.expanduser(argv[2])
-if len(argv) > 4:
-    gitObject = argv[4]  # To identify the old commit to diff with....
-else:
-    gitObject = ''  # If empty, uses git cache
-gitPrefix = check_output(['git', 'rev-parse',
-                          '--show-prefix']).decode('utf-8')[:-2]
-oldFileName = path.join(currentFilePath, 'gitdiff.md')
-oldFileText = check_output(['git', 'show', gitObject + ':' +
-                            path.join(gitPrefix, currentFileShortName)])\
-                                .decode('utf-8')
-
-# Create .tex file of file in git cache
-pandocConvert.writeMessage('Retrieving from git cache...')
-pandocConvert.writeFile(oldFileName, oldFileText)
-pandocConvert.convertMd(pandocTempDir, oldFileName, toFormat,
-                        toExtension, extraOptions, bookOptions,
-                        articleOptions, addedFilter)
-remove(oldFileName)  # No longer needed after conversion....
-
-# Create .tex file of current working file
-pandocConvert.writeMessage('Creating .tex of working file...')
-pandocConvert.convertMd(pandocTempDir, currentFileName, toFormat,
-                        toExtension, extraOptions, bookOptions,
-                        articleOptions, addedFilter)
-
-# Create texdiff file
-pandocConvert.writeMessage('Creating latexdiff...')
-tempDir = path.expanduser('~/tmp/pandoc')
-oldFileBaseName, null = path.splitext(path.basename(oldFileName))
-currentFileBaseName, null = path.splitext(currentFileShortName)
-oldTexName = path.join(tempDir, oldFileBaseName + '.tex')
-newTexName = path.join(tempDir, currentFileBaseName + '.tex')
-diffContents = check_output(['latexdiff', '--type=FONTSTRIKE',
-                             '--subtype=COLOR', oldTexName,
-                             newTexName]).decode('utf-8')
-pandocConvert.writeFile(newTexName, diffContents)
-
-# Convert to PDF
-pandocConvert.writeMessage('Converting to .pdf...')
-# Note: The `False` below is `bookFlag`, which is used in runLatex to determine
-# whether makeidx will be run, and so to set an enviroment flag accordingly.
-# Setting it False here will preserve security, when I don't care whether the
-# index is being produced.
-latexError = pandocConvert.runLatex(tempDir, currentFileBaseName,
-                                    '-pdf', False)
-if latexError:
-    pandocConvert.writeError('Error running LaTeX.')
-    exit(1)
-endFile = currentFileBaseName + '.pdf'
-if path.exists('/Applications/Skim.app'):
-    call(['open', '-a', '/Applications/Skim.app', '-g',
-          path.join(tempDir, endFile)])
-if path.exists('/System/Library/Sounds/Morse.aiff'):
-    call(['afplay', '/System/Library/Sounds/Morse.aiff'])
-pandocConvert.writeMessage('Conversion complete.')
-
-exit(0)
+if __name__ == '__main__':
+    if len(argv) > 4:
+        gitObject = argv[4]  # To identify the old commit to diff with....
+    else:
+        gitObject = ''  # If empty, uses git cache
+    exit(diffWithGit(argv[1].strip('"'), path.expanduser(argv[2]),
+                     gitObject))
@@ -7,9 +7,7 @@ the pandocConvert.py script to complete the conversion.
 """
 
 from sys import argv
-from distutils.spawn import find_executable
 from os import path
-from subprocess import run
 import pandocConvert
 
 theFile = argv[1].strip('"')
@@ -20,17 +18,7 @@ outputFile = baseFileName + '.tex'
 pandocTempDir = path.expanduser(argv[2])
 
 # Adjust for pandoc-citeproc's different versions on pandoc > 2.10.x
-pandocVersion = run(['pandoc', '--version'], encoding='utf8',
-                    capture_output=True)
-pandocVersionNumber = pandocVersion.stdout.split('\n')[0][7:]
-pandocVersionList = pandocVersionNumber.split('.')
-if int(pandocVersionList[0]) > 2 or (int(pandocVersionList[0]) == 2 and
-                                     int(pandocVersionList[1]) > 10):
-    extraOptions = '--citeproc'
-    addedFilter = []
-else:
-    extraOptions = ''
-    addedFilter = [find_executable('pandoc-citeproc')]
+extraOptions, addedFilter = pandocConvert.citeprocOptions()
 
 toFormat = 'beamer'
 toExtension = '.tex'
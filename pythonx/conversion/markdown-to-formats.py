@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+"""
+This script is designed to be run from within vim. It converts the current
+vim document to several formats at once, calling pandocConvert.py to read and
+preprocess the file once and then run the conversions in parallel. Call as:
+
+    markdown-to-formats.py file pandocTempDir format[,format...]
+
+where each format is one of the keys of `pandocConvert.formatOptions()`
+(e.g., `html,docx,pdf`).
+"""
+
+from os import path
+from sys import argv
+import pandocConvert
+
+if __name__ == '__main__':
+    theFile = argv[1].strip('"')
+    pandocTempDir = path.expanduser(argv[2])
+    options = pandocConvert.formatOptions()
+    formats = []
+    for name in argv[3].split(','):
+        if name in options:
+            formats.append(options[name])
+        else:
+            pandocConvert.writeError('Unknown format: ' + name + ' (use ' +
+                                     ', '.join(sorted(options)) + ')')
+    failures = pandocConvert.convertMdFormats(pandocTempDir, theFile,
+                                              formats)
+    exit(1 if failures or len(formats) < len(argv[3].split(',')) else 0)
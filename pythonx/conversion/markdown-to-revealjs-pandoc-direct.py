@@ -6,24 +6,12 @@ This script is designed to be run from within vim. It retrieves the filename
 the pandocConvert.py script to complete the conversion.
 """
 
-from distutils.spawn import find_executable
 from os import path, symlink, chdir, makedirs
-from subprocess import run
 from sys import argv
 import pandocConvert
 
 # Adjust for pandoc-citeproc's different versions on pandoc > 2.10.x
-pandocVersion = run(['pandoc', '--version'], encoding='utf8',
-                    capture_output=True)
-pandocVersionNumber = pandocVersion.stdout.split('\n')[0][7:]
-pandocVersionList = pandocVersionNumber.split('.')
-if int(pandocVersionList[0]) > 2 or (int(pandocVersionList[0]) == 2 and
-                                     int(pandocVersionList[1]) > 10):
-    extraOptions = '--citeproc'
-    addedFilter = []
-else:
-    extraOptions = ''
-    addedFilter = [find_executable('pandoc-citeproc')]
+extraOptions, addedFilter = pandocConvert.citeprocOptions()
 
 toFormat = 'revealjs'
 toExtension = '.html'
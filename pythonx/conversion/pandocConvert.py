@@ -19,12 +19,88 @@ Here's what each of these are (read from stdin):
     * imageFormat: the format of any images to be produced
 """
 
-from os import chdir, makedirs, listdir, environ, path, remove, rename
-from ruamel.yaml import YAML
-from ruamel.yaml.composer import ComposerError
-from subprocess import run, check_output, call
-from sys import stdout, stderr
-from time import time
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
+from functools import lru_cache
+from hashlib import sha256
+from json import dumps, loads
+from os import chdir, cpu_count, getpid, getpgrp, makedirs, listdir, \
+    environ, path, remove, replace, kill, killpg, setpgid, stat
+from re import compile
+from shlex import quote
+from shutil import copyfile, which
+from signal import signal, SIG_IGN, SIGTERM
+from subprocess import run, check_output, call, Popen, DEVNULL, STDOUT
+from sys import stdin, stdout, stderr
+from time import time, sleep
+from frontMatter import readFrontMatter, readFrontMatterText, \
+    FrontMatterError
+
+# Directories in which pandoc looks for filters not found relative to the
+# working directory
+PANDOC_DATA_DIRS = [path.join(environ.get('XDG_DATA_HOME',
+                                          path.expanduser('~/.local/share')),
+                              'pandoc'),
+                    path.expanduser('~/.pandoc')]
+BUILD_HASH_EXTENSION = '.buildhash'
+# Files on which the output of a conversion depends (see `findDependencies`):
+# those named in these pandoc options (besides filters and templates), and
+# images and files read by raw LaTeX in the markdown
+RESOURCE_OPTIONS = ['--reference-doc', '--css', '-c', '--include-in-header',
+                    '-H', '--include-before-body', '-B',
+                    '--include-after-body', '-A', '--bibliography', '--csl',
+                    '--citation-abbreviations', '--syntax-definition',
+                    '--epub-cover-image']
+RESOURCE_PATTERN = compile(
+    r'!\[[^\]\n]*\]\(\s*'
+    r'(?:<(?P<bracketed>[^>\n]+)>|(?P<image>[^)\s]+))|'
+    r'\\(?:includegraphics|input|include)\s*(?:\[[^\]]*\])?\s*'
+    r'\{(?P<latex>[^}]+)\}')
+VERSION_CACHE_FILE = path.expanduser(
+    '~/.cache/vim-pandoc-mine/pandoc-version.json')
+# For converting books section by section (see `runPandocBySection`): the
+# variables pandoc sets in the LaTeX template according to what is in the
+# document, which the skeleton of the book needs from every section
+SECTION_FLAGS = ['tables', 'graphics', 'svg', 'strikeout', 'verbatim-in-note',
+                 'subfigure']
+SECTION_TEMPLATE = ''.join('$if({0})$%flag {0}\n$endif$'.format(flag)
+                           for flag in SECTION_FLAGS) + \
+    '$if(highlighting-macros)$%macros\n$highlighting-macros$\n' + \
+    '%endmacros\n$endif$%body\n$body$\n'
+SECTION_MARKER = '% vim-pandoc-mine: {}'
+SECTION_FENCE = compile(r'[ ]{0,3}(`{3,}|~{3,})')
+# Lines a section needs from the rest of the book: those defining labels
+# (for cross-references), and footnote and link definitions
+SECTION_LABEL = compile(r'.*\{#[^\s}]')
+SECTION_DEFINITION = compile(r'\[(\^?[^\]]+)\]:')
+# Source map (see `addSourceMarkers`): the marker left in the LaTeX before
+# each top-level block, and the extension of the map file written next to the
+# .tex file. Markers are not put before lines that might continue the block
+# before (an indented line, a list item, a table or its caption, or a
+# definition).
+SOURCE_MARKER = '% vim-pandoc-mine: source {}'
+SOURCE_MARKER_BLOCK = '```{{=latex}}\n' + SOURCE_MARKER + '\n```\n\n'
+SOURCE_MARKER_LINE = compile(r'% vim-pandoc-mine: source (\S+)$')
+SOURCE_MAP_EXTENSION = '.texmap'
+SOURCE_SKIP = compile(r'[ \t]|[-+*|:~]|\d+[.)](?:\s|$)|\(@|Table:')
+SOURCE_QUOTE = compile(r'[ ]{0,3}>')
+LATEX_BEGIN = compile(r'\\begin\{')
+LATEX_END = compile(r'\\end\{')
+# Macros (see `preprocessFile`)
+# Like pandoc's math, a macro has no space after its opening `$` or before
+# its closing `$`. So each `$...$` matched is either a macro or math.
+MACRO_PATTERN = compile(r'\$([^\s${}](?:[^${}\n]*[^\s${}])?)'
+                        r'((?:\{[^{}$\n]*\})*)\$')
+MACRO_ARGUMENT = compile(r'\{([^{}$]*)\}')
+MACRO_DEPTH = 10
+# For LaTeX preview mode (see `runLatexPreview`): files kept next to the .tex
+# file with the watching latexmk's PID and format, its output, and the result
+# of its last run; and how long to wait for a run
+WATCHER_EXTENSION = '.latexmk-pid'
+WATCHER_LOG_EXTENSION = '.latexmk-log'
+WATCHER_STATUS_EXTENSION = '.latexmk-status'
+WATCHER_TIMEOUT = 600
+WATCHER_RUNNING = 'running'  # First line of status file during a LaTeX run
 
 
 """
@@ -68,12 +144,15 @@ def removeOldFiles(directory, time):
     """
     modTime = 60 * 60 * 24 * 4  # max number of seconds to keep aux files
     for file in listdir(directory):
-        if time - path.getmtime(path.join(directory, file)) > modTime and\
-           file != 'reveal.js':
-            try:
+        if file == 'reveal.js':
+            continue
+        # Other conversions (e.g., of `build-project.py`) may be removing
+        # the same files at the same time.
+        try:
+            if time - path.getmtime(path.join(directory, file)) > modTime:
                 remove(path.join(directory, file))
-            except OSError:
-                pass
+        except OSError:
+            pass
 
 
 def readFile(fileName):
@@ -85,9 +164,460 @@ def readFile(fileName):
     return text
 
 
-def runPandoc(pandocCommandList):
+def findFilter(filterName, luaFlag):
+    """
+    Return path to filter as pandoc would find it (or None)
+    """
+    if path.exists(filterName):
+        return filterName
+    if luaFlag:
+        for dataDir in PANDOC_DATA_DIRS:
+            filterPath = path.join(dataDir, 'filters', filterName)
+            if path.exists(filterPath):
+                return filterPath
+        return None
+    return which(filterName)
+
+
+def commandOptions(commandList):
+    """
+    Return (flag, value) for each item of a command, whether given as
+    `--flag=value` or as `--flag value`. (For the latter, the value is the
+    next item, which may not in fact belong to the flag.)
+    """
+    options = []
+    for item, nextItem in zip(commandList, commandList[1:] + ['']):
+        if item.startswith('--') and '=' in item:
+            options.append(tuple(item.split('=', 1)))
+        else:
+            options.append((item, nextItem))
+    return options
+
+
+def buildHash(mdText, pandocCommandList, pandocVersion, dependencies):
+    """
+    Hash everything that determines the output of a conversion: the
+    preprocessed text, the pandoc command, the contents of the filters it
+    calls, the tool versions, and the size and mtime of other files read
+    (such as bibliographies).
+    """
+    digest = sha256()
+    digest.update(mdText.encode('utf-8'))
+    digest.update('\0'.join(pandocCommandList).encode('utf-8'))
+    digest.update(pandocVersion.encode('utf-8'))
+    for flag, value in commandOptions(pandocCommandList):
+        if flag in ('--lua-filter', '--filter'):
+            filterPath = findFilter(value, flag == '--lua-filter')
+            if filterPath:
+                with open(filterPath, 'rb') as f:
+                    digest.update(f.read())
+    for dependency in dependencies:
+        try:
+            stat = path.getmtime(dependency), path.getsize(dependency)
+        except (OSError, TypeError):
+            stat = None
+        digest.update(repr((dependency, stat)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def findResource(name, resourcePath, dataSubdir=None, extensions=('',)):
+    """
+    Find file `name` (which may lack one of `extensions`) along pandoc's
+    resource path, and then in `dataSubdir` of pandoc's data directories.
+    Returns `name` itself if there is no such file.
+    """
+    name = path.expanduser(name)
+    directories = list(resourcePath)
+    if dataSubdir:
+        directories += [path.join(dataDir, dataSubdir)
+                        for dataDir in PANDOC_DATA_DIRS]
+    for directory in directories:
+        for extension in extensions:
+            candidate = path.join(directory, name + extension)
+            if path.exists(candidate):
+                return candidate
+    return name
+
+
+def findDependencies(mdText, yamlData, pandocCommandList, resourcePath):
+    """
+    Files other than the markdown and filters that affect the output:
+    bibliographies and csl files named in the YAML header, files named in
+    pandoc options (such as reference docs, css files, and templates),
+    images, and files read by raw LaTeX. (Those found are looked for along
+    pandoc's resource path.)
+    """
+    dependencies = []
+    for key in ('bibliography', 'csl'):
+        names = yamlData.get(key, [])
+        if isinstance(names, str):
+            names = [names]
+        for name in names:
+            dependencies.append(findResource(str(name), resourcePath))
+    toFormat = ''
+    for flag, value in commandOptions(pandocCommandList):
+        if flag == '--to':
+            toFormat = value
+        elif flag == '--template':
+            dependencies.append(findResource(value, resourcePath, 'templates',
+                                             ('', '.' + toFormat)))
+        elif flag in RESOURCE_OPTIONS:
+            dependencies.append(findResource(value, resourcePath))
+    for resourceMatch in RESOURCE_PATTERN.finditer(mdText):
+        image = resourceMatch.group('bracketed') or \
+            resourceMatch.group('image')
+        if image:
+            dependencies.append(findResource(image, resourcePath))
+        else:
+            dependencies.append(findResource(resourceMatch.group('latex'),
+                                             resourcePath,
+                                             extensions=('', '.tex')))
+    return dependencies
+
+
+def readBuildHash(hashFile):
+    try:
+        return readFile(hashFile).strip()
+    except OSError:
+        return None
+
+
+def getPandocVersion():
+    """
+    Return the first line of `pandoc --version` (e.g., 'pandoc 3.1.2'). This
+    is cached on disk, keyed on the location and mtime of the pandoc
+    executable, so pandoc is started only when it has been upgraded.
+    """
+    pandocPath = which('pandoc')
+    signature = [path.realpath(pandocPath), path.getmtime(pandocPath)] \
+        if pandocPath else None
+    try:
+        versionCache = loads(readFile(VERSION_CACHE_FILE))
+        if versionCache['signature'] == signature:
+            return versionCache['version']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass  # No (usable) cache
+    version = check_output(['/usr/bin/env', 'pandoc', '--version']) \
+        .decode('utf-8').split('\n')[0]
+    try:
+        makedirs(path.dirname(VERSION_CACHE_FILE), exist_ok=True)
+        tempFile = VERSION_CACHE_FILE + '.' + str(getpid())
+        writeFile(tempFile, dumps({'signature': signature,
+                                   'version': version}))
+        replace(tempFile, VERSION_CACHE_FILE)
+    except OSError:
+        pass
+    return version
+
+
+def pandocVersionNumbers():
+    """
+    Return pandoc's version as a list of ints (e.g., [3, 1, 2])
+    """
+    return [int(number) for number in
+            getPandocVersion().split(' ')[1].split('.') if number.isdigit()]
+
+
+def formatOptions():
+    """
+    Return a dictionary of the conversions available to scripts converting to
+    formats given by name, giving for each the arguments to pass to
+    `convertMd` after the file (as in the markdown-to-*.py scripts)
+    """
+    extraOptions, addedFilter = citeprocOptions()
+    cssFile = path.expanduser('~/Applications/pandoc/buttondown.css')
+    return {
+        'html': ('html5', '.html', extraOptions + ' --mathjax',
+                 '--toc --css=' + cssFile, '--css=' + cssFile, addedFilter),
+        'docx': ('docx', '.docx', extraOptions,
+                 '--reference-doc=' +
+                 path.expanduser('~/.pandoc/default-chapter-styles.docx'),
+                 '--reference-doc=' +
+                 path.expanduser('~/.pandoc/default-styles.docx'),
+                 addedFilter),
+        'pdf': ('latex', '.tex', '', '', '', ''),
+        'pdf-direct': ('latex', '.pdf', extraOptions, '', '', addedFilter),
+        'tex': ('latexraw', '.tex', '', '', '', ''),
+        'beamer': ('beamer', '.tex', extraOptions, '', '',
+                   addedFilter + ['pandocBeamerFilter.lua'])}
+
+
+def citeprocOptions():
+    """
+    Return (extraOptions, addedFilter) to process citations, allowing for
+    pandoc-citeproc's replacement by `--citeproc` in pandoc > 2.10.x
+    """
+    if pandocVersionNumbers()[:2] > [2, 10]:
+        return '--citeproc', []
+    return '', [which('pandoc-citeproc')]
+
+
+def runPandoc(pandocCommandList, mdText):
+    """
+    Run pandoc on `mdText` (sent to its stdin), returning its error code.
+    """
     writeMessage(str(pandocCommandList))
-    return run(pandocCommandList, shell=False).returncode
+    return run(pandocCommandList, input=mdText.encode('utf-8'),
+               shell=False).returncode
+
+
+def splitSections(mdText):
+    """
+    Split markdown text into its YAML header and a list of sections, each
+    beginning with a top-level (`# `) heading outside of code blocks. (Text
+    before the first heading is a section of its own.)
+    """
+    lines = mdText.splitlines(keepends=True)
+    yamlEnd = 0
+    if lines and lines[0].rstrip() == '---':
+        for lineNumber, line in enumerate(lines[1:], 1):
+            if line.rstrip() in ('---', '...'):
+                yamlEnd = lineNumber + 1
+                break
+    sections = [[]]
+    fence = None
+    for line in lines[yamlEnd:]:
+        fenceMatch = SECTION_FENCE.match(line)
+        if fence:
+            if fenceMatch and fenceMatch.group(1).startswith(fence):
+                fence = None
+        elif fenceMatch:
+            fence = fenceMatch.group(1)
+        elif line.startswith('# ') and any(sections[-1]):
+            sections.append([])
+        sections[-1].append(line)
+    return ''.join(lines[:yamlEnd]), [''.join(section) for section in sections]
+
+
+def addSourceMarkers(mdText):
+    """
+    Put a raw LaTeX comment marking where it came from before each top-level
+    block of `mdText`, so that lines of the .tex file can be traced back to
+    lines of the markdown (see `writeSourceMap`). A marker names its block
+    by the block's first line rather than its line number, so that the
+    LaTeX of a block does not change when lines are added above it (which
+    matters for `runPandocBySection`). No marker goes between blocks of one
+    block quote, which it would split. Returns the new text and a dictionary
+    of {marker name: line number}.
+    """
+    lines = mdText.splitlines(keepends=True)
+    sourceLines = {}
+    start = 0
+    if lines and lines[0].rstrip() == '---':
+        for lineNumber, line in enumerate(lines[1:], 1):
+            if line.rstrip() in ('---', '...'):
+                start = lineNumber + 1
+                break
+    output = lines[:start]
+    fence = None
+    latexDepth = 0
+    previousBlank = True
+    quote = False
+    for lineNumber, line in enumerate(lines[start:], start + 1):
+        fenceMatch = SECTION_FENCE.match(line)
+        if fence:
+            if fenceMatch and fenceMatch.group(1).startswith(fence):
+                fence = None
+        else:
+            continuesQuote = False
+            if previousBlank and line.strip():
+                continuesQuote = quote and SOURCE_QUOTE.match(line)
+                quote = bool(SOURCE_QUOTE.match(line))
+            if previousBlank and latexDepth == 0 and line.strip() and \
+                    not continuesQuote and not SOURCE_SKIP.match(line):
+                name = sha256(line.strip().encode('utf-8')).hexdigest()[:12]
+                if name in sourceLines:  # Same first line as an earlier block
+                    name += '-' + str(lineNumber)
+                sourceLines[name] = lineNumber
+                output.append(SOURCE_MARKER_BLOCK.format(name))
+            if fenceMatch:
+                fence = fenceMatch.group(1)
+            else:
+                # Inside a LaTeX environment, pandoc takes everything to its
+                # end as raw LaTeX, so no markers can go there.
+                latexDepth = max(0, latexDepth +
+                                 len(LATEX_BEGIN.findall(line)) -
+                                 len(LATEX_END.findall(line)))
+        previousBlank = not line.strip()
+        output.append(line)
+    return ''.join(output), sourceLines
+
+
+def writeSourceMap(latexFile, sourceLines):
+    """
+    Write the map from lines of the markdown to lines of `latexFile` to a
+    file next to it, as a JSON dictionary with the markdown lines (`source`)
+    and the corresponding .tex lines (`tex`) as lists sorted by markdown line,
+    and the .tex file's size and mtime (`signature`), so that a map that no
+    longer matches the .tex file can be spotted. `sourceLines` is from
+    `addSourceMarkers`; each block is mapped to the first non-blank line
+    after its marker.
+    """
+    pairs = []
+    name = None
+    with open(latexFile, 'r', encoding='utf-8') as f:
+        for texLine, line in enumerate(f, 1):
+            match = SOURCE_MARKER_LINE.match(line)
+            if match:
+                name = match.group(1)
+            elif name and line.strip():
+                if name in sourceLines:
+                    pairs.append((sourceLines[name], texLine))
+                name = None
+    pairs.sort()
+    latexStat = stat(latexFile)
+    writeFile(path.splitext(latexFile)[0] + SOURCE_MAP_EXTENSION,
+              dumps({'source': [source for source, tex in pairs],
+                     'tex': [tex for source, tex in pairs],
+                     'signature': [latexStat.st_mtime_ns,
+                                   latexStat.st_size]}))
+
+
+def sectionDefinitions(section):
+    """
+    Return what other sections might need from `section`: the lines that
+    define labels (for cross-references), and a dictionary of footnote and
+    link definitions, keyed on their (lowercase) `[label]`
+    """
+    labels = []
+    definitions = {}
+    definition = None
+    for line in section.splitlines():
+        definitionMatch = SECTION_DEFINITION.match(line)
+        if definitionMatch:
+            definition = '[' + definitionMatch.group(1).lower() + ']'
+            definitions[definition] = line
+        elif definition and (not line.strip() or
+                             line.startswith(('    ', '\t'))):
+            definitions[definition] += '\n' + line
+        else:
+            definition = None
+            if SECTION_LABEL.match(line):
+                labels.append(line)
+    return labels, definitions
+
+
+def rawLatex(text):
+    return '```{=latex}\n' + text + '\n```\n'
+
+
+def readSection(sectionFile):
+    """
+    Return (flags, highlighting macros, body) from a section converted with
+    SECTION_TEMPLATE
+    """
+    flags = set()
+    macros = []
+    lines = readFile(sectionFile).split('\n')
+    bodyStart = lines.index('%body')
+    inMacros = False
+    for line in lines[:bodyStart]:
+        if line == '%macros':
+            inMacros = True
+        elif line == '%endmacros':
+            inMacros = False
+        elif inMacros:
+            macros.append(line)
+        elif line.startswith('%flag '):
+            flags.add(line[6:])
+    body = lines[bodyStart + 1:]
+    begin = body.index(SECTION_MARKER.format('begin'))
+    end = body.index(SECTION_MARKER.format('end'))
+    return flags, '\n'.join(macros), '\n'.join(body[begin + 1:end])
+
+
+def runPandocBySection(pandocCommandList, mdText, pandocVersion, cacheDir):
+    """
+    Convert a book to LaTeX one top-level section at a time, reusing the
+    LaTeX of every section that has not changed since it was last converted.
+    Each section is converted with the YAML header, the labels defined in
+    other sections, and the footnote and link definitions from other
+    sections that it uses (all of whose output is discarded), so that
+    cross-references come out as they would for the whole book. Changed
+    sections are converted in parallel. The preamble comes from converting
+    the YAML header alone, with the template variables that the sections'
+    contents set. Returns an error code as `runPandoc` does.
+    """
+    outFile = pandocCommandList[3]
+    pandocOptions = pandocCommandList[4:]
+    yamlText, sections = splitSections(mdText)
+    definitions = [sectionDefinitions(section) for section in sections]
+    makedirs(cacheDir, exist_ok=True)
+    templateFile = path.join(cacheDir, 'section.latex')
+    writeFile(templateFile, SECTION_TEMPLATE)
+    sectionOptions = pandocOptions + ['--template=' + templateFile]
+
+    def sectionJob(sectionText, options):
+        """
+        Return (output file, arguments for `runPandoc` or None if output is
+        cached)
+        """
+        key = buildHash(SECTION_TEMPLATE + sectionText, options,
+                        pandocVersion, [])
+        sectionFile = path.join(cacheDir, key + '.tex')
+        if path.exists(sectionFile):
+            return sectionFile, None
+        return sectionFile, (['/usr/bin/env', 'pandoc', '-o',
+                              sectionFile] + options, sectionText)
+
+    jobs = []
+    for number, section in enumerate(sections):
+        lowerSection = section.lower()
+        otherDefinitions = []
+        for otherNumber, (labels, notes) in enumerate(definitions):
+            if otherNumber != number:
+                otherDefinitions += labels
+                otherDefinitions += [text for label, text in notes.items()
+                                     if label in lowerSection]
+        otherDefinitions = '\n\n'.join(otherDefinitions)
+        sectionText = (yamlText + '\n' +
+                       rawLatex(SECTION_MARKER.format('begin')) + '\n' +
+                       section + '\n\n' +
+                       rawLatex(SECTION_MARKER.format('end')) + '\n' +
+                       otherDefinitions + '\n')
+        jobs.append(sectionJob(sectionText, sectionOptions))
+    commands = [command for sectionFile, command in jobs if command]
+    writeMessage('Converting {} of {} sections ({} unchanged)'.format(
+        len(commands), len(jobs), len(jobs) - len(commands)))
+    with ThreadPoolExecutor(max_workers=cpu_count()) as executor:
+        errors = list(executor.map(lambda command: runPandoc(*command),
+                                   commands))
+    if any(errors):
+        return max(errors)
+
+    flags = set()
+    macros = ''
+    fragments = []
+    for sectionFile, command in jobs:
+        sectionFlags, sectionMacros, fragment = readSection(sectionFile)
+        flags |= sectionFlags
+        macros = macros or sectionMacros
+        fragments.append(fragment)
+
+    # Preamble and closing of book
+    skeletonOptions = pandocOptions[:]
+    for flag in sorted(flags):
+        skeletonOptions += ['--variable', flag + '=true']
+    if macros:
+        skeletonOptions += ['--variable', 'highlighting-macros=' + macros]
+    skeletonFile, command = sectionJob(
+        yamlText + '\n' + rawLatex(SECTION_MARKER.format('body')),
+        skeletonOptions)
+    if command:
+        error = runPandoc(*command)
+        if error:
+            return error
+    skeleton = readFile(skeletonFile)
+    writeFile(outFile, skeleton.replace(SECTION_MARKER.format('body'),
+                                        '\n\n'.join(fragments), 1))
+
+    # Forget sections that are no longer in the book
+    keep = {path.basename(sectionFile) for sectionFile, command in jobs}
+    keep |= {path.basename(skeletonFile), path.basename(templateFile)}
+    for file in listdir(cacheDir):
+        if file not in keep:
+            remove(path.join(cacheDir, file))
+    return 0
 
 
 def removeAuxFiles(latexPath, baseFilename):
@@ -100,6 +630,70 @@ def removeAuxFiles(latexPath, baseFilename):
             pass
 
 
+def expandMacros(text, macros, depth=0):
+    """
+    Replace all macros in `text` in one scan: each `$...$` is looked up in
+    `macros`, so the cost does not grow with the number of macros. A `$...$`
+    that is not a macro (i.e., math) leaves its closing `$` to open the next
+    one. Macros in replacements are expanded in turn, to MACRO_DEPTH, beyond
+    which a ConversionError is raised (as a macro must then be using itself).
+    """
+    pieces = []
+    position = 0
+    match = MACRO_PATTERN.search(text)
+    while match:
+        key, arguments = match.groups()
+        if key not in macros:  # Math
+            pieces.append(text[position:match.end() - 1])
+            position = match.end() - 1
+            match = MACRO_PATTERN.search(text, position)
+            continue
+        if depth >= MACRO_DEPTH:
+            raise ConversionError('Macro ${}$ is nested more than {} deep. '
+                                  'Does it use itself?'.format(key,
+                                                               MACRO_DEPTH))
+        value = macros[key]
+        arguments = MACRO_ARGUMENT.findall(arguments)
+        # Replace `#10` before `#1`
+        for number in range(len(arguments), 0, -1):
+            value = value.replace('#' + str(number), arguments[number - 1])
+        if '$' in value:
+            value = expandMacros(value, macros, depth + 1)
+        pieces.append(text[position:match.start()])
+        pieces.append(value)
+        position = match.end()
+        match = MACRO_PATTERN.search(text, position)
+    pieces.append(text[position:])
+    return ''.join(pieces)
+
+
+def expandMacroValue(value, macros):
+    """
+    Return macro `value` with the macros in it expanded, or as it is if it
+    takes arguments or uses itself (for `expandMacros` to deal with if the
+    macro is used)
+    """
+    if '#' in value:
+        return value
+    try:
+        return expandMacros(value, macros)
+    except ConversionError:
+        return value
+
+
+@lru_cache(maxsize=None)
+def prepareMacros(macroItems):
+    """
+    Return dictionary of macros from `macroItems` (a tuple of (key, value)
+    pairs), with macros in their values already expanded where they take no
+    arguments. This is cached, so each document's macros are prepared once
+    (e.g., across conversions to several formats or sections of a book).
+    """
+    macros = dict(macroItems)
+    return {key: expandMacroValue(value, macros)
+            for key, value in macros.items()}
+
+
 def preprocessFile(baseFileName, fileExtension, text, yamlData):
     """
     Macros:
@@ -111,26 +705,32 @@ def preprocessFile(baseFileName, fileExtension, text, yamlData):
         macros:
         - first: this is the substituted text
           second: this is more substituted text
+        - third: this uses $first$
+          fourth: this takes arguments, #1 and #2
 
     2. Then in text, have users specify macros to be substituted as follows:
 
-        This is my text and $first$. This is more text and $second$.
+        This is my text and $first$. This is more text and $second$. And
+        $fourth{one}{two}$.
 
     As long as the macro labels are not identical to any actual math the user
-    would use, there should be no problem.
+    would use, there should be no problem. Macros may be used in other macros.
+    `#1`, `#2`, ... in a macro are replaced by its arguments.
     """
-    try:
-        macros = yamlData['macros'][0]
-        for key in macros:
-            text = text.replace('$' + str(key) + '$', str(macros[key]))
-    except KeyError:
-        pass  # No macros in file
-    return text
+    macroList = yamlData.get('macros') or []
+    if isinstance(macroList, dict):
+        macroList = [macroList]
+    macros = {}
+    for macroDict in macroList:
+        if isinstance(macroDict, dict):
+            macros.update((str(key), str(value))
+                          for key, value in macroDict.items())
+    if not macros:
+        return text  # No macros in file
+    return expandMacros(text, prepareMacros(tuple(sorted(macros.items()))))
 
 
-def runLatex(latexPath, baseFileName, latexFormat, bookFlag):
-    # Need to produce .pdf file, which will be opened by runLatex script...
-    # chdir(latexPath)
+def setLatexEnvironment(bookFlag):
     environ['PATH'] = '/Library/TeX/texbin:' + environ['PATH']
     # Note that `makeidx` is unhappy with my setting pandocTempDir outside the
     # document directory out of security concerns. According to documentation
@@ -140,6 +740,14 @@ def runLatex(latexPath, baseFileName, latexFormat, bookFlag):
     # book is being typeset.
     if bookFlag:
         environ['openout_any'] = 'a'
+
+
+def runLatex(latexPath, baseFileName, latexFormat, bookFlag):
+    # Need to produce .pdf file, which will be opened by runLatex script...
+    # chdir(latexPath)
+    # A watcher left from preview mode would fight with this run.
+    stopLatexWatcher(latexPath, baseFileName)
+    setLatexEnvironment(bookFlag)
     latexFile = path.join(latexPath, baseFileName + '.tex')
 
     texCommand = ['latexmk', latexFormat, '-f', '-synctex=1',
@@ -153,10 +761,170 @@ def runLatex(latexPath, baseFileName, latexFormat, bookFlag):
     return False     # No error
 
 
-def convertMd(pandocTempDir, myFile, toFormat, toExtension,
-              extraOptions, bookOptions, articleOptions, addedFilter):
-    writeMessage('Starting conversion to ' + toExtension)
+def latexPreviewEnabled():
+    return environ.get('PANDOC_LATEX_PREVIEW', '0') not in ('', '0')
+
+
+def processRunning(pid):
+    try:
+        kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
 
+def readLatexWatcher(latexPath, baseFileName):
+    """
+    Return (PID, latexFormat) of the latexmk watching the .tex file, or
+    (None, None) if there is none
+    """
+    try:
+        pid, latexFormat = readFile(path.join(
+            latexPath, baseFileName + WATCHER_EXTENSION)).split()
+        pid = int(pid)
+    except (OSError, ValueError):
+        return None, None
+    return (pid, latexFormat) if processRunning(pid) else (None, None)
+
+
+def stopLatexWatcher(latexPath, baseFileName):
+    """
+    Stop the latexmk watching the .tex file, if any
+    """
+    watcherFile = path.join(latexPath, baseFileName + WATCHER_EXTENSION)
+    if not path.exists(watcherFile):
+        return
+    pid, latexFormat = readLatexWatcher(latexPath, baseFileName)
+    if pid:
+        try:
+            killpg(pid, SIGTERM)  # latexmk and the LaTeX it is running
+        except OSError:
+            pass
+    remove(watcherFile)
+
+
+def perlString(text):
+    return "'" + text.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def startLatexWatcher(latexPath, baseFileName, latexFormat):
+    """
+    Start a latexmk that stays running, typesetting the .tex file again
+    whenever it (or a file it uses) changes. Each run starts the status file
+    with WATCHER_RUNNING, and adds 0 (success) or 1 (failure) when it ends.
+    """
+    latexFile = path.join(latexPath, baseFileName + '.tex')
+    statusFile = quote(path.join(latexPath,
+                                 baseFileName + WATCHER_STATUS_EXTENSION))
+    texCommand = ['latexmk', latexFormat, '-pvc', '-view=none', '-f',
+                  '-interaction=nonstopmode', '-synctex=1',
+                  '-auxdir=' + latexPath, '-outdir=' + latexPath,
+                  '-e', '$sleep_time = 1; ' +
+                  '$compiling_cmd = ' +
+                  perlString('echo ' + WATCHER_RUNNING + ' > ' + statusFile) +
+                  '; $success_cmd = ' + perlString('echo 0 >> ' + statusFile) +
+                  '; $failure_cmd = ' + perlString('echo 1 >> ' + statusFile),
+                  latexFile]
+    with open(path.join(latexPath, baseFileName + WATCHER_LOG_EXTENSION),
+              'w') as logFile:
+        # In a session of its own, so that it outlives this script and can be
+        # stopped along with the LaTeX it runs
+        watcher = Popen(texCommand, stdin=DEVNULL, stdout=logFile,
+                        stderr=STDOUT, start_new_session=True)
+    writeFile(path.join(latexPath, baseFileName + WATCHER_EXTENSION),
+              '{} {}\n'.format(watcher.pid, latexFormat))
+    return watcher
+
+
+def runLatexPreview(latexPath, baseFileName, latexFormat, bookFlag,
+                    newLatexFile):
+    """
+    Typeset `newLatexFile` (just written by pandoc) with a latexmk that keeps
+    running between conversions, starting one if needed. The .tex file is
+    replaced only if `newLatexFile` differs from it, so latexmk reruns only
+    when something changed, and then only the LaTeX passes it needs. Waits for
+    latexmk to finish, and returns True if there was an error.
+    """
+    latexFile = path.join(latexPath, baseFileName + '.tex')
+    pdfFile = path.join(latexPath, baseFileName + '.pdf')
+    statusFile = path.join(latexPath, baseFileName + WATCHER_STATUS_EXTENSION)
+    pid, watcherFormat = readLatexWatcher(latexPath, baseFileName)
+    if pid and watcherFormat != latexFormat:
+        stopLatexWatcher(latexPath, baseFileName)
+        pid = None
+    watcher = None
+    try:
+        changed = readFile(newLatexFile) != readFile(latexFile)
+    except OSError:
+        changed = True
+    if changed or not pid:
+        # The status must be gone before latexmk can see the new .tex file. A
+        # run that started before then (on the old file) may still add its
+        # result, but without WATCHER_RUNNING before it.
+        if path.exists(statusFile):
+            remove(statusFile)
+    if changed:
+        replace(newLatexFile, latexFile)
+    else:
+        remove(newLatexFile)
+        writeMessage('LaTeX file unchanged.')
+    if not pid:
+        writeMessage('Starting latexmk preview...')
+        setLatexEnvironment(bookFlag)
+        watcher = startLatexWatcher(latexPath, baseFileName, latexFormat)
+        if not changed and path.exists(pdfFile) and \
+                path.getmtime(pdfFile) >= path.getmtime(latexFile):
+            # latexmk may find nothing to do, and so report nothing.
+            return False
+
+    def readStatus():
+        """
+        Return the result of the last run started since the status file was
+        removed, or None if there is none yet
+        """
+        try:
+            status = readFile(statusFile).split()
+        except OSError:
+            return None
+        if len(status) < 2 or status[0] != WATCHER_RUNNING:
+            return None
+        return status[-1]
+
+    startTime = time()
+    status = readStatus()
+    while status is None:
+        # (A watcher started here is a child of this process, and must be
+        # asked whether it has exited.)
+        running = watcher.poll() is None if watcher else processRunning(pid)
+        if not running:
+            writeError('LaTeX Error!: latexmk stopped; see ' + baseFileName +
+                       WATCHER_LOG_EXTENSION)
+            return True
+        if time() - startTime > WATCHER_TIMEOUT:
+            writeError('LaTeX Error!: gave up waiting for latexmk')
+            return True
+        sleep(0.1)
+        status = readStatus()
+    if status != '0':
+        writeError('LaTeX Error!: see ' + baseFileName + '.log')
+        return True
+    return False
+
+
+class ConversionError(Exception):
+    """
+    Raised when a conversion cannot be completed; the message says why
+    """
+
+
+def prepareDocument(pandocTempDir, myFile, mdText=None):
+    """
+    Do the work that conversions of `myFile` to any format share: read it,
+    parse its YAML header, and replace macros. Returns a dictionary describing
+    the document, for `prepareConversion`. If `mdText` is given, it is
+    converted instead of the contents of `myFile` (e.g., for an old version of
+    the file from git), as though it were at `myFile`.
+    """
     pandocTempDirImages = path.join(pandocTempDir, 'Figures')
 
     # Make sure temporary path exists for LaTeX compilation
@@ -165,9 +933,8 @@ def convertMd(pandocTempDir, myFile, toFormat, toExtension,
     except OSError:
         pass
 
-    pandocVersion = check_output(['/usr/bin/env', 'pandoc', '--version']) \
-        .decode('utf-8').split('\n')[0].split(' ')[1].split('.')
-    if int(pandocVersion[0]) < 2 and int(pandocVersion[1]) < 19:
+    pandocVersion = pandocVersionNumbers()
+    if pandocVersion[0] < 2 and pandocVersion[1] < 19:
         platform = 'old'
     else:
         platform = 'new'
@@ -180,7 +947,62 @@ def convertMd(pandocTempDir, myFile, toFormat, toExtension,
     filePath, fileName = path.split(myFile)
     chdir(filePath)  # This is needed to be able to pick up relative paths
     baseFileName, fileExtension = path.splitext(fileName)
-    mdText = readFile(myFile)
+
+    # Get YAML data
+    bookFlag = False
+    latexFormat = '-pdf'
+    try:
+        if mdText is None:
+            mdText = readFile(myFile)
+            yamlData = readFrontMatter(myFile)
+        else:
+            yamlData = readFrontMatterText(mdText)
+    except FrontMatterError:
+        raise ConversionError("ERROR: Cannot parse YAML header. If any " +
+                              "of '%@*' are in yaml header, it needs " +
+                              "to be enclosed in quotes.")
+    # Check to see if we need to use chapters or sections for 1st-level
+    # heading
+    if 'book' in yamlData:
+        bookFlag = yamlData['book']
+        if bookFlag is True:
+            bookFlag = 'chapter'
+    # Set how latexmk creates pdf file (whether using pdflatex, lualatex,
+    # or xelatex). Default is pdflatex.
+    if 'lualatex' in yamlData and yamlData['lualatex']:
+        latexFormat = '-lualatex'
+    elif 'xelatex' in yamlData and yamlData['xelatex']:
+        latexFormat = '-xelatex'
+
+    # Preprocess markdown text, replacing macros
+    sourceText = mdText
+    mdText = preprocessFile(baseFileName, fileExtension, mdText,
+                            yamlData)
+    return {'pandocTempDir': pandocTempDir,
+            'filePath': filePath,
+            'baseFileName': baseFileName,
+            'fileExtension': fileExtension,
+            'sourceText': sourceText,
+            'mdText': mdText,
+            'yamlData': yamlData,
+            'bookFlag': bookFlag,
+            'latexFormat': latexFormat,
+            'platform': platform,
+            'pandocVersion': getPandocVersion()}
+
+
+def prepareConversion(document, toFormat, toExtension, extraOptions,
+                      bookOptions, articleOptions, addedFilter):
+    """
+    Work out the pandoc command to convert `document` (from
+    `prepareDocument`) to the given format. Returns a dictionary describing
+    the conversion, for `runConversion`.
+    """
+    filePath = document['filePath']
+    baseFileName = document['baseFileName']
+    mdText = document['mdText']
+    yamlData = document['yamlData']
+    bookFlag = document['bookFlag']
 
     # Figure out command to send to pandoc
     suppressPdfFlag = False
@@ -188,12 +1010,15 @@ def convertMd(pandocTempDir, myFile, toFormat, toExtension,
         suppressPdfFlag = True
         toFormat = 'latex'
 
+    # Pandoc reads the text from stdin, so relative paths are resolved from
+    # the resource path rather than the location of the file.
+    resourcePath = [filePath,
+                    path.expanduser('~/Documents/research/+texmf/bibtex/bib/')]
     pandocOptions = ['--standalone',
                      '--from=markdown-fancy_lists+smart',
                      '--mathml',
                      '--wrap=none',
-                     '--resource-path=./:' +
-                     path.expanduser('~/Documents/research/+texmf/bibtex/bib/'),
+                     '--resource-path=' + ':'.join(resourcePath),
                      # '--log=$USER/tmp/pandoc/log',
                      '--to=' + toFormat]
     pandocOptions += ['--lua-filter', 'fixYAML.lua']
@@ -212,6 +1037,15 @@ def convertMd(pandocTempDir, myFile, toFormat, toExtension,
             else:
                 pandocOptions = pandocOptions + ['--filter', myFilter]
 
+    sourceFlag = toFormat == 'latex' and toExtension == '.tex' and \
+        not suppressPdfFlag and pandocVersionNumbers() >= [2]
+    sourceLines = {}
+    if sourceFlag:
+        # Markers go in before macros are expanded, so that the source map
+        # has line numbers of the file rather than of the expanded text.
+        mdText, sourceLines = addSourceMarkers(document['sourceText'])
+        mdText = preprocessFile(baseFileName, document['fileExtension'],
+                                mdText, yamlData)
     # If converting to LaTeX, I don't want to update image locations. So I'll
     # set `processimage: false` in YAML, which signals to
     # `pandocCommentFilter.lua` not to do this.
@@ -219,56 +1053,20 @@ def convertMd(pandocTempDir, myFile, toFormat, toExtension,
         location = mdText.find('\n') + 1
         mdText = mdText[:location] + 'processimage: false\n' + mdText[location:]
 
-    # Get YAML data
-    mdTextSplit = mdText.splitlines()
-    bookFlag = False
-    yamlText = []
-    yamlData = {}
-    latexFormat = '-pdf'
-    if mdTextSplit[0] == '---':  # Need to process YAML header
-        for line in mdTextSplit[1:]:
-            if line == "---":
-                break
-            yamlText.append(line)
-        yaml = YAML(typ='safe')
-        try:
-            yamlData = yaml.load('\n'.join(yamlText))
-        except ComposerError:
-            writeError("ERROR: Cannot parse YAML header. If any of '%@*' " +
-                       "are in yaml header, it needs to be enclosed " +
-                       "in quotes.")
-            exit(1)
-        # Check to see if we need to use chapters or sections for 1st-level
-        # heading
-        if 'book' in yamlData:
-            bookFlag = yamlData['book']
-            if bookFlag is True:
-                bookFlag = 'chapter'
-        # Set how latexmk creates pdf file (whether using pdflatex, lualatex,
-        # or xelatex). Default is pdflatex.
-        if 'lualatex' in yamlData and yamlData['lualatex']:
-            latexFormat = '-lualatex'
-        elif 'xelatex' in yamlData and yamlData['xelatex']:
-            latexFormat = '-xelatex'
-        if toExtension == '.tex' and 'biblatex' in yamlData and \
-                yamlData['biblatex']:
-            pandocOptions.append('--biblatex')
-        if toExtension == '.html' and 'htmltoc' in yamlData and \
-                yamlData['htmltoc']:
-            pandocOptions.append('--toc')
-
-    # Preprocess markdown text, replacing macros
-    mdText = preprocessFile(baseFileName, fileExtension, mdText,
-                            yamlData)
-    myFile = path.join(filePath, baseFileName + '-processed' + fileExtension)
-    writeFile(myFile, mdText)
+    if toExtension == '.tex' and 'biblatex' in yamlData and \
+            yamlData['biblatex']:
+        pandocOptions.append('--biblatex')
+    if toExtension == '.html' and 'htmltoc' in yamlData and \
+            yamlData['htmltoc']:
+        pandocOptions.append('--toc')
 
     if toFormat == 'latex' and toExtension == '.pdf':
         # Set `--pdf-engine` for pandoc conversion direct to .pdf
         latexEngine = {'-pdf': 'pdflatex',
                        '-lualatex': 'lualatex',
                        '-xelatex': 'xelatex'}
-        pandocOptions.append('--pdf-engine=' + latexEngine[latexFormat])
+        pandocOptions.append('--pdf-engine=' +
+                             latexEngine[document['latexFormat']])
 
     if bookFlag:
         pandocOptions.append('--top-level-division=' + bookFlag)
@@ -276,62 +1074,267 @@ def convertMd(pandocTempDir, myFile, toFormat, toExtension,
     else:
         pandocOptions = pandocOptions + articleOptions.split()
 
-    outFile = path.join(filePath, baseFileName + toExtension)
-    if path.exists(outFile):
-        writeError('Error: ' + outFile + ' already exists! Delete it and try again.')
-        remove(myFile)
-        exit(1)
-    pandocCommandList = ['/usr/bin/env', 'pandoc', myFile, '-o',
-                         outFile] + pandocOptions
+    outFile = path.join(document['pandocTempDir'], baseFileName + toExtension)
+    pandocCommandList = ['/usr/bin/env', 'pandoc', '-o', outFile] + \
+        pandocOptions
+    # Books may be converted section by section (see `runPandocBySection`).
+    # This works only for LaTeX, where numbering and cross-references are
+    # left to LaTeX, and only if pandoc is not formatting citations itself.
+    sectionFlag = bookFlag and yamlData.get('sectioncache') and \
+        toFormat == 'latex' and toExtension == '.tex' and \
+        not any('citeproc' in option for option in pandocOptions)
+    latexFlag = (toFormat == 'latex' and toExtension == '.tex'
+                 and not suppressPdfFlag) or toFormat == 'beamer'
+    # The artifacts this conversion leaves in pandocTempDir
+    artifacts = [path.join(document['pandocTempDir'],
+                           baseFileName + toExtension)]
+    if latexFlag:
+        artifacts.append(path.join(document['pandocTempDir'],
+                                   baseFileName + '.pdf'))
+    if sourceFlag:
+        artifacts.append(path.join(document['pandocTempDir'],
+                                   baseFileName + SOURCE_MAP_EXTENSION))
+    return dict(document,
+                mdText=mdText,
+                toFormat=toFormat,
+                toExtension=toExtension,
+                suppressPdfFlag=suppressPdfFlag,
+                sectionFlag=sectionFlag,
+                latexFlag=latexFlag,
+                sourceLines=sourceLines if sourceFlag else None,
+                artifacts=artifacts,
+                dependencies=findDependencies(mdText, yamlData,
+                                              pandocCommandList,
+                                              resourcePath),
+                pandocCommandList=pandocCommandList)
+
+
+def runConversion(conversion, useCache=True, quiet=False, openResult=True):
+    """
+    Run pandoc (and LaTeX) for a `conversion` from `prepareConversion`, and
+    open the result (unless `openResult` is false). If `useCache` is true (and
+    $PANDOC_BUILD_CACHE is not 0), pandoc is skipped when nothing that would
+    affect its output has changed since the last conversion of this file to
+    this format. If `quiet` is true, no sound is played when done. Returns
+    True if pandoc was skipped.
+    """
+    pandocTempDir = conversion['pandocTempDir']
+    filePath = conversion['filePath']
+    baseFileName = conversion['baseFileName']
+    toExtension = conversion['toExtension']
+    suppressPdfFlag = conversion['suppressPdfFlag']
+    latexFlag = conversion['latexFlag']
+    pandocCommandList = conversion['pandocCommandList']
+    chdir(filePath)  # This is needed to be able to pick up relative paths
 
     # Run pandoc
-    if platform == 'old':
+    if conversion['platform'] == 'old':
         # If on raspberrypi, sync the bibliographical database.
         writeMessage('Synchronizing bibTeX databases...')
         run(['$USER/coding/sync-bib.py'])
-    pandocError = runPandoc(pandocCommandList)
-    if pandocError:
-        writeError('Error creating ' + toExtension + ' file: ' +
-                   str(pandocError))
-        exit(1)
 
     endFile = baseFileName + toExtension
-    # Move file from directory of original .md doc to pandocTempDir
-    writeMessage("Moving " + endFile + " to " + path.join(pandocTempDir,
-                 endFile))
-    rename(path.join(filePath, endFile), path.join(pandocTempDir, endFile))
-    # Delete processed file
-    remove(myFile)
-
-    if (toFormat == 'latex' and toExtension == '.tex'
-            and not suppressPdfFlag) or toFormat == 'beamer':
-        writeMessage('Successfully created LaTeX file...')
+    artifacts = conversion['artifacts']
+    # Skip pandoc if the artifacts were built from exactly the same input.
+    # (LaTeX is run regardless: latexmk keeps track of the files it reads,
+    # and does nothing if none has changed.)
+    hashFile = path.join(pandocTempDir, endFile + BUILD_HASH_EXTENSION)
+    useCache = useCache and environ.get('PANDOC_BUILD_CACHE') != '0'
+    latexPreview = latexFlag and latexPreviewEnabled()
+    currentHash = buildHash(conversion['mdText'], pandocCommandList,
+                            conversion['pandocVersion'],
+                            conversion['dependencies'])
+    cacheHit = useCache and readBuildHash(hashFile) == currentHash and \
+        all(path.exists(artifact) for artifact in artifacts)
+    if cacheHit:
+        writeMessage('No changes since last conversion; reusing ' +
+                     ', '.join(artifacts))
+    else:
+        # Whatever happens, the old artifacts no longer match the hash.
+        if path.exists(hashFile):
+            remove(hashFile)
+        runCommandList = pandocCommandList
+        if latexPreview:
+            # Write to a new file, so that the .tex file is left alone if
+            # nothing has changed (see `runLatexPreview`).
+            newLatexFile = pandocCommandList[3] + '.new'
+            runCommandList = pandocCommandList[:3] + [newLatexFile] + \
+                pandocCommandList[4:]
+        if conversion['sectionFlag']:
+            pandocError = runPandocBySection(
+                runCommandList, conversion['mdText'],
+                conversion['pandocVersion'],
+                path.join(pandocTempDir, baseFileName + '-sections'))
+        else:
+            pandocError = runPandoc(runCommandList, conversion['mdText'])
+        if pandocError:
+            if latexPreview and path.exists(newLatexFile):
+                remove(newLatexFile)
+            raise ConversionError('Error creating ' + toExtension +
+                                  ' file: ' + str(pandocError))
+
+    if latexFlag:
+        if not cacheHit:
+            writeMessage('Successfully created LaTeX file...')
+        elif latexPreview:
+            # Have the preview find the .tex file unchanged.
+            newLatexFile = pandocCommandList[3] + '.new'
+            copyfile(pandocCommandList[3], newLatexFile)
         # Run LaTeX
-        latexError = runLatex(pandocTempDir, baseFileName, latexFormat,
-                              bookFlag)
+        if latexPreview:
+            latexError = runLatexPreview(pandocTempDir, baseFileName,
+                                         conversion['latexFormat'],
+                                         conversion['bookFlag'],
+                                         newLatexFile)
+        else:
+            latexError = runLatex(pandocTempDir, baseFileName,
+                                  conversion['latexFormat'],
+                                  conversion['bookFlag'])
+        if conversion['sourceLines'] is not None and not cacheHit:
+            writeSourceMap(path.join(pandocTempDir, baseFileName + '.tex'),
+                           conversion['sourceLines'])
         if latexError:
-            writeError('Error running LaTeX.')
-            exit(1)
+            raise ConversionError('Error running LaTeX.')
         endFile = baseFileName + '.pdf'
+    if openResult and (latexFlag or toExtension == '.pdf'):
         if path.exists('/Applications/Skim.app'):
             call(['/usr/bin/open', '-a', '/Applications/Skim.app', '-g',
                   path.join(pandocTempDir, endFile)])
-    else:
-        if toExtension == '.pdf':
-            if path.exists('/Applications/Skim.app'):
-                call(['/usr/bin/open', '-a', '/Applications/Skim.app', '-g',
-                      path.join(pandocTempDir, endFile)])
-        else:
-            if path.exists('/usr/bin/open') and not suppressPdfFlag:
-                call(['/usr/bin/open', '-g',
-                      path.join(pandocTempDir, endFile)])
+    elif openResult and path.exists('/usr/bin/open') and \
+            not suppressPdfFlag:
+        call(['/usr/bin/open', '-g', path.join(pandocTempDir, endFile)])
+    if not cacheHit:
+        writeFile(hashFile, currentHash + '\n')
     # If on raspberrypi, upload resulting file to dropbox.
-    if platform == 'old':
+    if conversion['platform'] == 'old':
         message = check_output(
             ['$USER/Applications/dropbox-uploader/dropbox_uploader.sh',
              'upload', path.join(pandocTempDir, endFile),
              endFile]).decode('utf-8')[:-1]
         writeMessage(message)
-    if path.exists('/System/Library/Sounds/Morse.aiff') \
-            and not suppressPdfFlag:
+    if not quiet and not suppressPdfFlag:
+        playSound()
+    return cacheHit
+
+
+def playSound():
+    if path.exists('/System/Library/Sounds/Morse.aiff'):
         call(['/usr/bin/afplay', '/System/Library/Sounds/Morse.aiff'])
+
+
+def stopChildrenOnTermination():
+    """
+    Make this process lead a process group of its own (unless run from a
+    terminal), and when it is terminated (e.g., when vim replaces it with a
+    newer conversion), terminate the group, so that pandoc and LaTeX do not
+    go on to overwrite the output of the newer conversion. LaTeX watchers
+    (see `startLatexWatcher`) have sessions of their own, and keep running.
+    """
+    if getpgrp() != getpid() and not stdin.isatty():
+        try:
+            setpgid(0, 0)
+        except OSError:
+            pass
+    if getpgrp() != getpid():
+        return
+
+    def terminate(signum, frame):
+        signal(SIGTERM, SIG_IGN)
+        if getpgrp() == getpid():  # Not in a worker process
+            killpg(getpid(), SIGTERM)
+        exit(1)
+
+    signal(SIGTERM, terminate)
+
+
+def convertMd(pandocTempDir, myFile, toFormat, toExtension,
+              extraOptions, bookOptions, articleOptions, addedFilter,
+              useCache=True):
+    """
+    Convert `myFile`, leaving the result in `pandocTempDir`. (See
+    `runConversion` for `useCache`.)
+    """
+    writeMessage('Starting conversion to ' + toExtension)
+    stopChildrenOnTermination()
+    try:
+        document = prepareDocument(pandocTempDir, myFile)
+        runConversion(prepareConversion(document, toFormat, toExtension,
+                                        extraOptions, bookOptions,
+                                        articleOptions, addedFilter),
+                      useCache)
+    except ConversionError as error:
+        writeError(str(error))
+        exit(1)
+
+
+def timeConversion(conversion, useCache):
+    """
+    Run `conversion` (in a worker process); returns the time taken
+    """
+    startTime = time()
+    runConversion(conversion, useCache, quiet=True)
+    return time() - startTime
+
+
+def convertMdFormats(pandocTempDir, myFile, formats, useCache=True):
+    """
+    Convert `myFile` to several formats at once. `formats` is a list of
+    (toFormat, toExtension, extraOptions, bookOptions, articleOptions,
+    addedFilter) tuples, as for `convertMd`. The file is read, its YAML parsed
+    and its macros replaced only once; pandoc (and LaTeX) then run for all
+    formats in parallel in a pool of processes. Reports the time taken by
+    each format, and returns the number of formats that failed. (Depending on
+    the platform, the processes may import the calling script again, so it
+    must do its work only under `if __name__ == '__main__':`.)
+    """
+    writeMessage('Starting conversion to ' +
+                 ', '.join(toExtension for toFormat, toExtension, *options
+                           in formats))
+    stopChildrenOnTermination()
+    try:
+        document = prepareDocument(pandocTempDir, myFile)
+    except ConversionError as error:
+        writeError(str(error))
+        return len(formats)
+
+    conversions = []
+    failures = 0
+    for toFormat, toExtension, *options in formats:
+        try:
+            conversion = prepareConversion(document, toFormat, toExtension,
+                                           *options)
+        except ConversionError as error:
+            writeError(str(error))
+            failures += 1
+            continue
+        # Outputs are named after the file, so two formats producing the same
+        # kind of file (e.g., two .pdfs) would overwrite each other.
+        if any(set(conversion['artifacts']) & set(other['artifacts'])
+               for other in conversions):
+            writeError('Error: cannot convert to ' + toFormat + ' with ' +
+                       'another format producing ' +
+                       ', '.join(conversion['artifacts']))
+            failures += 1
+            continue
+        conversions.append(conversion)
+    if not conversions:
+        return failures
+
+    with ProcessPoolExecutor(max_workers=min(len(conversions),
+                                             cpu_count())) as executor:
+        futures = {executor.submit(timeConversion, conversion, useCache):
+                   conversion for conversion in conversions}
+        for future in as_completed(futures):
+            toExtension = futures[future]['toExtension']
+            try:
+                writeMessage('Finished {} in {:.1f} s'.format(
+                    toExtension, future.result()))
+            except Exception as error:  # Report, and let others finish
+                writeError('Error converting to ' + toExtension + ': ' +
+                           str(error))
+                failures += 1
+    if not failures and \
+            not all(conversion['suppressPdfFlag']
+                    for conversion in conversions):
+        playSound()
+    return failures
@@ -10,7 +10,8 @@ in this script. `latexFormat` determines how output is generated, whether
 by pdf (= pdflatex), lualatex, or xelatex.
 '''
 
-from os import environ, system, path, remove, makedirs, chdir
+from os import environ, path, remove, makedirs, chdir
+from subprocess import call, DEVNULL
 from sys import argv
 
 ERROR_FILE = path.expanduser('~/tmp/pandoc/error.log')
@@ -19,7 +20,7 @@ ERROR_FILE = path.expanduser('~/tmp/pandoc/error.log')
 def writeError(errorMsg):
     with open(ERROR_FILE, 'a') as errorFile:
         errorFile.write(errorMsg)
-    system('/usr/bin/open -a MacVim.app ' + ERROR_FILE)
+    call(['/usr/bin/open', '-a', 'MacVim.app', ERROR_FILE])
     return
 
 
@@ -50,16 +51,16 @@ chdir(LATEX_PATH)
 
 environ['PATH'] = environ['PATH'] + ':/Library/TeX/texbin'
 
-texCommand = 'latexmk {} -synctex=1 "{}" &>/dev/null'.format(
-        latexFormat,
-        path.join(LATEX_PATH, FILENAME + FILE_EXTENSION))
-latexError = system(texCommand)
+texCommand = ['latexmk', latexFormat, '-synctex=1',
+              path.join(LATEX_PATH, FILENAME + FILE_EXTENSION)]
+latexError = call(texCommand, stdout=DEVNULL, stderr=DEVNULL)
 if latexError:
-    system('/usr/bin/open -a MacVim.app "{}"'.format(path.join(LATEX_PATH,
-                                                     FILENAME + '.log')))
+    call(['/usr/bin/open', '-a', 'MacVim.app',
+          path.join(LATEX_PATH, FILENAME + '.log')])
     # removeAuxFiles(FILENAME)
     writeError('LaTeX Error!')
 else:
-    system('open -a /Applications/Skim.app -g "{}" &>/dev/null'.format(
-                                path.join(LATEX_PATH, FILENAME + '.pdf')))
-    system('afplay /System/Library/Sounds/Morse.aiff')
+    call(['open', '-a', '/Applications/Skim.app', '-g',
+          path.join(LATEX_PATH, FILENAME + '.pdf')],
+         stdout=DEVNULL, stderr=DEVNULL)
+    call(['afplay', '/System/Library/Sounds/Morse.aiff'])
@@ -0,0 +1,41 @@
+'''
+Answer requests sent over vim's JSON channel protocol, for the long-running
+servers that vim runs (`bibliography-server.py` and
+`conversion/jump-server.py`). Each request is a line
+`[id, {"method": ..., "args": [...]}]`, answered with a line `[id, result]`
+(or `[id, {"error": message}]`). `methods` is a dictionary of the functions
+that can be called, keyed on their names.
+'''
+
+from contextlib import nullcontext
+from json import dumps, loads
+from sys import stdin, stdout
+
+
+def handleRequest(line, methods, lock=None):
+    """ Answer one request line, calling the method while holding `lock` (if
+    given); returns reply line (or None if the line is not a request) """
+    try:
+        requestId, request = loads(line)
+        methodName = request['method']
+    except (ValueError, TypeError, KeyError):
+        return None
+    if methodName not in methods:
+        return dumps([requestId, {'error': 'Unknown method: ' +
+                                  str(methodName)}]) + '\n'
+    try:
+        with lock or nullcontext():
+            result = methods[methodName](*request.get('args', []))
+    except Exception as error:  # Report to vim rather than dying
+        result = {'error': str(error)}
+    return dumps([requestId, result]) + '\n'
+
+
+def serveStdio(methods, lock=None):
+    """ Answer requests from stdin on stdout (for a vim job) until stdin is
+    closed """
+    for line in stdin:
+        reply = handleRequest(line, methods, lock)
+        if reply:
+            stdout.write(reply)
+            stdout.flush()
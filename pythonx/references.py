@@ -1,47 +1,535 @@
 #!/usr/bin/env python3
 
+from atexit import register
+from bisect import bisect_left
+from collections import OrderedDict
+from heapq import nlargest
+from itertools import count
+from os import getpid, makedirs, path, replace
 from os.path import expanduser
-from re import findall, match, search, sub, IGNORECASE
+from pickle import dump, load, HIGHEST_PROTOCOL
+from re import compile, search, VERBOSE
 from sys import stdout
+from unicodedata import combining, normalize
 from subprocess import check_output, CalledProcessError
+from threading import RLock, Thread
+from zlib import crc32
 # from vim import eval
 
 
+# .bib databases to read: (name for kpsewhich, fallback location)
+BIB_DATABASES = [
+    ('Bibdatabase.bib',
+     '~/Documents/research/+texmf/bibtex/bib/bibdatabase.bib'),
+    ('Bibdatabase-helm.bib',
+     '~/Documents/research/+texmf/bibtex/bib/bibdatabase-helm.bib')]
+CACHE_DIR = expanduser('~/.cache/vim-pandoc-mine')
+CACHE_FILE = path.join(CACHE_DIR, 'bibcache.pickle')
+RENDER_CACHE_FILE = path.join(CACHE_DIR, 'rendercache.pickle')
+RENDER_CACHE_SIZE = 5000  # Max number of rendered entries to remember
+RENDER_CACHE_SAVE = 500  # Save after this many new renderings
+CACHE_VERSION = 8  # Bump whenever the format of cached entries changes
+BIB_MONTHS = {'jan': 'January', 'feb': 'February', 'mar': 'March',
+              'apr': 'April', 'may': 'May', 'jun': 'June', 'jul': 'July',
+              'aug': 'August', 'sep': 'September', 'oct': 'October',
+              'nov': 'November', 'dec': 'December'}
+# Entry types formatted as books (e.g., parents of incollection entries)
+BOOK_TYPES = ('book', 'mvbook', 'collection', 'mvcollection', 'proceedings',
+              'mvproceedings', 'reference', 'mvreference')
+
+# Patterns for the .bib parser
+BIB_ENTRY = compile(r'@\s*([A-Za-z]+)\s*([{(])')
+BIB_KEY = compile(r'\s*([^,\s})]*)\s*,?')
+BIB_FIELD = compile(r'([^\s=,{}()"#]+)\s*=')
+BIB_NEXT_FIELD = compile(r',')
+BIB_WORD = compile(r'[^\s,#{}()"]+')
+BIB_SPACE = compile(r'\s*')
+BIB_WHITESPACE = compile(r'\s+')
+BIB_SEPARATOR = compile(r'[\s,]*')
+BIB_BRACE = compile(r'(?<!\\)[{}]')
+BIB_QUOTE = compile(r'(?<!\\)[{}"]')
+# LaTeX to markdown/unicode conversions (see `removeLatex`)
+LATEX_GROUPS = {'emph': '*', 'textit': '*', 'mkbibemph': '*',
+                'textbf': '**', 'mkbibquote': '"'}
+LATEX_ACCENTS = {"'": '\u0301', '`': '\u0300', '^': '\u0302', '"': '\u0308',
+                 '~': '\u0303', '=': '\u0304', '.': '\u0307', 'u': '\u0306',
+                 'v': '\u030c', 'H': '\u030b', 'c': '\u0327', 'k': '\u0328',
+                 'r': '\u030a', 'd': '\u0323', 'b': '\u0331'}
+LATEX_LETTERS = {'ss': 'ß', 'ae': 'æ', 'AE': 'Æ', 'oe': 'œ', 'OE': 'Œ',
+                 'aa': 'å', 'AA': 'Å', 'o': 'ø', 'O': 'Ø', 'l': 'ł', 'L': 'Ł',
+                 'i': 'ı', 'j': 'ȷ'}
+LATEX_PATTERN = compile(r'''
+    \\(?P<group>emph|textit|mkbibemph|textbf|mkbibquote)\s*\{
+  | \\(?P<accent>['`^"~=.]|[uvHckrdb](?![A-Za-z]))\s*
+    (?:\{\s*(?P<braced>\\?[A-Za-z])\s*\}|(?P<bare>\\?[A-Za-z]))
+  | \\(?P<stray>['`^"~=.])
+  | \\(?P<letter>ss|ae|AE|oe|OE|aa|AA|o|O|l|L|i|j)(?![A-Za-z])\x20?
+  | \\(?P<ellipsis>ldots|dots|textellipsis)(?![A-Za-z])(?:\{\})?
+  | \\(?P<escaped>[&%$#_{}])
+  | \\(?P<command>[A-Za-z]+)\s*(?=\{)
+  | (?P<open>\{)
+  | (?P<close>\})
+  ''', VERBOSE)
+
+# Patterns for the search index
+INDEX_TOKEN = compile(r'\w+')
+INDEX_POSSESSIVE = compile(r"['’]s\b")
+FUZZY_MIN_LENGTH = 4  # Shorter words must match exactly, even when fuzzy
+INDEX_FOLDING = str.maketrans({'ß': 'ss', 'æ': 'ae', 'œ': 'oe', 'ø': 'o',
+                               'ł': 'l', 'ı': 'i', 'ȷ': 'j'})
+INDEX_YEAR = compile(r'\d{4}')
+INDEX_KEY_FRAGMENT = compile(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])|[0-9]+')
+
+# Resolved .bib databases, and the `bibFileSignature` they were resolved with
+bibFiles = {'files': [], 'signature': None}
+# The parsed bibliography is kept at module level so that it survives between
+# calls from vim (which imports this module once per session). `signature`
+# records the resolved .bib paths with their mtimes and sizes; the entries are
+# re-read only when it changes. `index` is the inverted index used to search
+# the entries (see `buildBibIndex`), `keys` maps lowercase citation keys to
+# entry ids, and `parents` memoizes formatted crossref parents.
+bibCache = {'signature': None, 'entries': [], 'index': {}, 'keys': {},
+            'parents': {}}
+# LRU cache of rendered entries: (entry, shortEntry, completion dict), keyed
+# on citation key and hashes of the entry and of its crossref parent. Since
+# the keys include the hashes, stale renderings are simply never hit again.
+renderCache = {'entries': OrderedDict(), 'loaded': False, 'unsaved': 0}
+# The caches are shared with background queries (see `submitBibQuery`), so
+# access to them goes through this lock.
+bibLock = RLock()
+# Background queries, keyed on query id. Each is a dictionary with `done`
+# (1 when the search has finished) and `words` (results found so far).
+bibQueries = {}
+bibQueryIds = count(1)
+
+
 def debug(message):
     stdout.write(message + '\n')
 
 
 def readFile(fileName):
     """ Read text from file on disk. """
-    with open(fileName, 'r') as f:
+    with open(fileName, 'r', encoding='utf-8') as f:
         text = f.read()
     return text
 
 
-def getBibData():
-    """ Read data from .bib files """
+def bibFileSignature(fileList):
+    """ Identify state of resolved .bib files by whether they exist and the
+    mtime of the directory holding them (which changes when .bib files are
+    added to, removed from, or renamed in it) """
+    signature = []
+    for bibFile in fileList:
+        try:
+            directoryTime = path.getmtime(path.dirname(bibFile))
+        except OSError:
+            directoryTime = None
+        signature.append((path.exists(bibFile), directoryTime))
+    return tuple(signature)
+
+
+def findBibFiles():
+    """ Resolve .bib databases. (kpsewhich is slow, so this is done again
+    only when a resolved file has gone or its directory has changed.) """
+    if not bibFiles['files'] or \
+            bibFileSignature(bibFiles['files']) != bibFiles['signature']:
+        fileList = []
+        for bibName, fallback in BIB_DATABASES:
+            try:
+                bibFile = check_output(['kpsewhich', bibName])[:-1]\
+                    .decode('utf-8')
+            except (CalledProcessError, OSError):
+                bibFile = expanduser(fallback)
+            fileList.append(bibFile)
+        bibFiles['files'] = fileList
+        bibFiles['signature'] = bibFileSignature(fileList)
+    return bibFiles['files']
+
+
+def bibSignature(fileList):
+    """ Identify state of .bib files by path, mtime, and size """
+    signature = []
+    for bibFile in fileList:
+        try:
+            fileStat = path.getmtime(bibFile), path.getsize(bibFile)
+        except OSError:
+            fileStat = None, None
+        signature.append((bibFile,) + fileStat)
+    return tuple(signature)
+
+
+def findClosingBrace(bibText, position):
+    """ Return position just past the brace matching the one opened before
+    `position` (or the end of text if unbalanced) """
+    depth = 1
+    for braceMatch in BIB_BRACE.finditer(bibText, position):
+        if braceMatch.group(0) == '{':
+            depth += 1
+        elif braceMatch.group(0) == '}':
+            depth -= 1
+            if depth == 0:
+                return braceMatch.end()
+    return len(bibText)
+
+
+def parseBibValue(bibText, position, macros):
+    """ Parse a (possibly `#`-concatenated) field value starting at
+    `position`. Returns value and position following it. """
+    value = ''
+    while True:
+        position = BIB_SPACE.match(bibText, position).end()
+        char = bibText[position:position + 1]
+        if char == '{':
+            end = findClosingBrace(bibText, position + 1)
+            value += bibText[position + 1:end - 1]
+            position = end
+        elif char == '"':
+            # Quotes only end a value outside of braces
+            depth = 0
+            end = position + 1
+            for quoteMatch in BIB_QUOTE.finditer(bibText, end):
+                end = quoteMatch.end()
+                if quoteMatch.group(0) == '{':
+                    depth += 1
+                elif quoteMatch.group(0) == '}':
+                    depth -= 1
+                elif depth <= 0:
+                    break
+            value += bibText[position + 1:end - 1]
+            position = end
+        else:
+            wordMatch = BIB_WORD.match(bibText, position)
+            if not wordMatch:
+                break
+            word = wordMatch.group(0)
+            position = wordMatch.end()
+            if word.isdigit():
+                value += word
+            else:
+                value += macros.get(word.lower(), word)
+        position = BIB_SPACE.match(bibText, position).end()
+        if bibText[position:position + 1] != '#':
+            break
+        position += 1
+    return BIB_WHITESPACE.sub(' ', value), position
+
+
+def parseBibFields(bibText, position, closer, macros):
+    """ Parse `name = value` pairs up to `closer`. Returns dictionary of
+    fields (with lowercase names) and position following `closer`. """
+    fields = {}
+    while position < len(bibText):
+        position = BIB_SEPARATOR.match(bibText, position).end()
+        if bibText[position:position + 1] in (closer, ''):
+            return fields, position + 1
+        fieldMatch = BIB_FIELD.match(bibText, position)
+        if not fieldMatch:  # Malformed field; skip to next one
+            nextField = BIB_NEXT_FIELD.search(bibText, position)
+            position = nextField.end() if nextField else len(bibText)
+            continue
+        value, position = parseBibValue(bibText, fieldMatch.end(), macros)
+        fields[fieldMatch.group(1).lower()] = value
+    return fields, position
+
+
+def parseBibEntries(bibText, macros=None):
+    """ Parse .bib text into entries of the form {'type': ..., 'hash': ...,
+    'key': ..., 'fields': {...}} in a single pass. `@string` macros are
+    expanded (and collected in `macros`); `@comment` and `@preamble` are
+    skipped. """
+    if macros is None:
+        macros = dict(BIB_MONTHS)
+    entries = []
+    position = bibText.find('@')
+    while position != -1:
+        entryMatch = BIB_ENTRY.match(bibText, position)
+        if not entryMatch:
+            position = bibText.find('@', position + 1)
+            continue
+        entryType = entryMatch.group(1).lower()
+        closer = '}' if entryMatch.group(2) == '{' else ')'
+        if entryType in ('comment', 'preamble'):
+            end = findClosingBrace(bibText, entryMatch.end())
+        elif entryType == 'string':
+            fields, end = parseBibFields(bibText, entryMatch.end(), closer,
+                                         macros)
+            macros.update(fields)
+        else:
+            keyMatch = BIB_KEY.match(bibText, entryMatch.end())
+            fields, end = parseBibFields(bibText, keyMatch.end(), closer,
+                                         macros)
+            entries.append({'type': entryType,
+                            'hash': crc32(bibText[position:end].encode()),
+                            'key': keyMatch.group(1).strip(),
+                            'fields': {name: value.strip() for name, value
+                                       in fields.items()}})
+        position = bibText.find('@', end)
+    return entries
+
+
+def loadBibCache(signature=None):
+    """ Load parsed entries from disk if they match `signature` (or, if no
+    signature is given, whatever the disk cache holds) """
     try:
-        bibFile = check_output(['kpsewhich', 'Bibdatabase.bib'])[:-1].decode('utf-8')
-    except CalledProcessError as e:
-        bibFile = expanduser('~/Documents/research/+texmf/bibtex/bib/bibdatabase.bib')
-    bibText = readFile(bibFile)
+        with open(CACHE_FILE, 'rb') as f:
+            diskCache = load(f)
+    except Exception:  # Missing, unreadable, or stale pickle
+        return False
+    if diskCache.get('version') != CACHE_VERSION or \
+            signature and diskCache.get('signature') != signature:
+        return False
+    del diskCache['version']
+    bibCache.update(diskCache)
+    return True
+
+
+def saveBibCache():
+    """ Write parsed entries to disk (atomically, since several vim instances
+    may share the cache) """
     try:
-        bibFile = check_output(['kpsewhich', 'Bibdatabase-helm.bib'])[:-1].decode('utf-8')
-    except CalledProcessError as e:
-        bibFile = expanduser('~/Documents/research/+texmf/bibtex/bib/bibdatabase-helm.bib')
-    bibText += readFile(bibFile)
-    bibDataList = findall(r'@[^@]*', bibText)
-    return bibDataList
+        makedirs(CACHE_DIR, exist_ok=True)
+        tempFile = CACHE_FILE + '.' + str(getpid()) + '.tmp'
+        with open(tempFile, 'wb') as f:
+            dump(dict(bibCache, version=CACHE_VERSION, parents={}), f,
+                 HIGHEST_PROTOCOL)
+        replace(tempFile, CACHE_FILE)
+    except OSError:
+        pass  # Caching is an optimization only
 
 
-def retrieveBibField(bibItem, fieldname):
+def loadRenderCache():
+    """ Load rendered entries saved by earlier sessions """
+    renderCache['loaded'] = True
+    try:
+        with open(RENDER_CACHE_FILE, 'rb') as f:
+            diskCache = load(f)
+    except Exception:  # Missing, unreadable, or stale pickle
+        return
+    if diskCache.get('version') == CACHE_VERSION:
+        diskCache['entries'].update(renderCache['entries'])
+        renderCache['entries'] = diskCache['entries']
+
+
+@register
+def saveRenderCache():
+    """ Write rendered entries to disk, if there are new ones """
+    if not renderCache['unsaved']:
+        return
+    renderCache['unsaved'] = 0
     try:
-        field = search(r'\b' + fieldname + r'\s*=\s*{(.*)}[,}]', bibItem,
-                       IGNORECASE).group(1)
-    except AttributeError:
-        field = ''
-    debug("Field:" + field)
-    return field
+        makedirs(CACHE_DIR, exist_ok=True)
+        tempFile = RENDER_CACHE_FILE + '.' + str(getpid()) + '.tmp'
+        with open(tempFile, 'wb') as f:
+            dump({'version': CACHE_VERSION,
+                  'entries': renderCache['entries']}, f, HIGHEST_PROTOCOL)
+        replace(tempFile, RENDER_CACHE_FILE)
+    except OSError:
+        pass  # Caching is an optimization only
+
+
+def getBibData():
+    """ Return parsed entries from .bib files, re-reading the files only when
+    they have changed """
+    fileList = findBibFiles()
+    signature = bibSignature(fileList)
+    if not renderCache['loaded']:
+        loadRenderCache()
+    if bibCache['signature'] != signature:
+        bibCache['parents'] = {}
+        if not loadBibCache(signature):
+            entries = []
+            for bibFile, mtime, size in signature:
+                if mtime is not None:
+                    entries += parseBibEntries(readFile(bibFile))
+            bibCache['signature'] = signature
+            bibCache['entries'] = entries
+            bibCache['index'] = buildBibIndex(entries)
+            # (BibTeX keys are case-insensitive; first definition wins.)
+            bibCache['keys'] = {}
+            for entryId in range(len(entries) - 1, -1, -1):
+                bibCache['keys'][entries[entryId]['key'].lower()] = entryId
+            saveBibCache()
+    return bibCache['entries']
+
+
+def lookupBibEntry(key):
+    """ Return entry with citation key `key` (or None) """
+    entryId = bibCache['keys'].get(key.lower())
+    if entryId is None:
+        return None
+    return bibCache['entries'][entryId]
+
+
+def indexTokens(bibItem):
+    """ Return normalized search tokens for entry: words of names, title, and
+    year, plus the key (and any crossref key) and its fragments (e.g.,
+    `Kant1785Groundwork` gives `kant1785groundwork`, `kant`, `1785`,
+    `groundwork`) """
+    fields = bibItem['fields']
+    text = ' '.join([fields.get('author', ''), fields.get('editor', ''),
+                     fields.get('title', ''), fields.get('booktitle', ''),
+                     fields.get('year', '')])
+    tokens = set(searchWords(removeLatex(text)))
+    for key in [bibItem['key'], fields.get('crossref', '')]:
+        key = removeLatex(key)
+        tokens.add(foldAccents(key))
+        tokens.update(foldAccents(fragment) for fragment in
+                      INDEX_KEY_FRAGMENT.findall(key))
+    tokens.discard('')
+    return tokens
+
+
+def foldAccents(text):
+    """ Lowercase text and strip diacritics (so `Schönecker` matches
+    `schon`) """
+    text = normalize('NFKD', text.lower()).translate(INDEX_FOLDING)
+    return ''.join(char for char in text if not combining(char))
+
+
+def searchWords(text):
+    """ Split text into normalized words for the search index """
+    return INDEX_TOKEN.findall(INDEX_POSSESSIVE.sub('', foldAccents(text)))
+
+
+def rankingData(bibItem):
+    """ Return (key, surnames, title words, year) used to rank entry """
+    fields = bibItem['fields']
+    surnames = []
+    for name in removeLatex(fields.get('author') or
+                            fields.get('editor', '')).split(' and '):
+        if ',' in name:
+            surnames += searchWords(name[:name.find(',')])
+        else:
+            surnames += searchWords(name)[-1:]
+    year = INDEX_YEAR.search(fields.get('year', ''))
+    return (foldAccents(removeLatex(bibItem['key'])), tuple(surnames),
+            tuple(searchWords(removeLatex(fields.get('title', '')))),
+            int(year.group(0)) if year else 0)
+
+
+def buildBibIndex(entries):
+    """ Build inverted index mapping tokens to the (sorted) list of ids of
+    entries containing them. Tokens are also kept in a sorted list so that
+    prefixes can be looked up with a binary search. `ranking` holds the data
+    used to score matches (see `scoreBibEntry`), and `trigrams` maps
+    trigrams to the ids (positions in `tokens`) of tokens containing them,
+    for fuzzy searches. """
+    postings = {}
+    for entryId, bibItem in enumerate(entries):
+        for token in indexTokens(bibItem):
+            postings.setdefault(token, []).append(entryId)
+    tokens = sorted(postings)
+    trigrams = {}
+    for tokenId, token in enumerate(tokens):
+        for trigram in set(tokenTrigrams(token)):
+            trigrams.setdefault(trigram, []).append(tokenId)
+    return {'tokens': tokens, 'postings': postings, 'trigrams': trigrams,
+            'ranking': [rankingData(bibItem) for bibItem in entries]}
+
+
+def tokenTrigrams(word):
+    """ Return trigrams of word, marking its beginning (so that, e.g., `kor`
+    gives `$ko` and `kor`) """
+    word = '$' + word
+    return [word[i:i + 3] for i in range(len(word) - 2)]
+
+
+def prefixDistance(word, token, maxDistance):
+    """ Return edit distance between word and closest prefix of token (or
+    maxDistance + 1 if greater than maxDistance) """
+    previousRow = list(range(len(token) + 1))
+    for i, char in enumerate(word, 1):
+        row = [i]
+        for j, tokenChar in enumerate(token, 1):
+            row.append(min(previousRow[j] + 1, row[j - 1] + 1,
+                           previousRow[j - 1] + (char != tokenChar)))
+        if min(row) > maxDistance:
+            return maxDistance + 1
+        previousRow = row
+    return min(previousRow)
+
+
+def findFuzzyTokens(word):
+    """ Return {tokenId: distance} for tokens whose start is within a few
+    edits of word. Candidates are found through shared trigrams, so only a
+    handful of tokens are compared. """
+    index = bibCache['index']
+    maxDistance = 1 if len(word) < 7 else 2
+    wordTrigrams = set(tokenTrigrams(word))
+    # Each edit spoils at most three trigrams
+    required = len(wordTrigrams) - 3 * maxDistance
+    shared = {}
+    for trigram in wordTrigrams:
+        for tokenId in index['trigrams'].get(trigram, []):
+            shared[tokenId] = shared.get(tokenId, 0) + 1
+    matches = {}
+    for tokenId, sharedCount in shared.items():
+        if sharedCount >= max(required, 1):
+            # Only the part of token that could match word matters
+            token = index['tokens'][tokenId][:len(word) + maxDistance]
+            distance = prefixDistance(word, token, maxDistance)
+            if distance <= maxDistance:
+                matches[tokenId] = distance
+    return matches
+
+
+def findBibMatches(base, fuzzy=0):
+    """ Return ids of entries that have tokens starting with every word in
+    base. If fuzzy, tokens may also start with something a few edits away
+    from the word (for words of at least FUZZY_MIN_LENGTH characters); the
+    ids are then returned as a dictionary, giving the total number of edits
+    needed for each entry. """
+    index = bibCache['index']
+    tokens = index['tokens']
+    matches = None
+    # Longer words are more selective, so start with them
+    for word in sorted(searchWords(base), key=len, reverse=True):
+        wordMatches = {}
+        if fuzzy and len(word) >= FUZZY_MIN_LENGTH:
+            for tokenId, distance in findFuzzyTokens(word).items():
+                for entryId in index['postings'][tokens[tokenId]]:
+                    if distance < wordMatches.get(entryId, distance + 1):
+                        wordMatches[entryId] = distance
+        else:
+            position = bisect_left(tokens, word)
+            while position < len(tokens) and \
+                    tokens[position].startswith(word):
+                wordMatches.update(dict.fromkeys(
+                    index['postings'][tokens[position]], 0))
+                position += 1
+        if matches is None:
+            matches = wordMatches
+        else:
+            matches = {entryId: distance + wordMatches[entryId] for
+                       entryId, distance in matches.items() if
+                       entryId in wordMatches}
+        if not matches:
+            break
+    if matches is None:  # Nothing to search for: everything matches
+        return dict.fromkeys(range(len(bibCache['entries'])), 0) if fuzzy \
+            else range(len(bibCache['entries']))
+    return matches if fuzzy else matches.keys()
+
+
+def scoreBibEntry(entryId, words):
+    """ Score how well entry matches search words: for each word, a match at
+    the start of the key beats a match on a surname, which beats a match on
+    a word in the title. Ties go to more recent entries. """
+    key, surnames, titleWords, year = bibCache['index']['ranking'][entryId]
+    score = 0
+    for word in words:
+        if key.startswith(word):
+            score += 3
+        elif any(surname.startswith(word) for surname in surnames):
+            score += 2
+        elif any(titleWord.startswith(word) for titleWord in titleWords):
+            score += 1
+    return score, year
+
+
+def retrieveBibField(bibItem, fieldname):
+    """ Look up field of parsed .bib entry ('' if missing) """
+    return bibItem['fields'].get(fieldname.lower(), '')
 
 
 def constructBookEntry(bibItem):
@@ -57,13 +545,10 @@ def constructBookEntry(bibItem):
     year = retrieveBibField(bibItem, 'year')
     entry += ' (' + year + ').'
     shortEntry += '(' + year + ').'
-    booktitle = retrieveBibField(bibItem, 'booktitle')
-    if booktitle != '':
-        entry += ' *' + booktitle + '*.'
-        shortEntry += ' *' + booktitle + '*.'
-    else:
-        entry += ' *' + retrieveBibField(bibItem, 'title') + '*.'
-        shortEntry += ' *' + retrieveBibField(bibItem, 'title') + '*.'
+    title = retrieveBibField(bibItem, 'booktitle') or \
+        retrieveBibField(bibItem, 'title')
+    entry += ' *' + title + '*.'
+    shortEntry += ' *' + title + '*.'
     publisher = retrieveBibField(bibItem, 'publisher')
     if publisher != '':
         address = retrieveBibField(bibItem, 'address')
@@ -90,13 +575,11 @@ def constructArticleEntry(bibItem):
         shortauthor = author[author.rindex(' ') + 1:]
     else:
         shortauthor = author
-    entry = author + ' (' + retrieveBibField(bibItem, 'year') + '). "' + \
-        retrieveBibField(bibItem, 'title') + '". *' + \
-        retrieveBibField(bibItem, 'journal') + '*.'
-    shortEntry = shortauthor + '(' + \
-        retrieveBibField(bibItem, 'year') + '). "' + \
+    citation = ' (' + retrieveBibField(bibItem, 'year') + '). "' + \
         retrieveBibField(bibItem, 'title') + '". *' + \
         retrieveBibField(bibItem, 'journal') + '*.'
+    entry = author + citation
+    shortEntry = shortauthor + citation[1:]
     volume = retrieveBibField(bibItem, 'volume')
     if volume != '':
         entry += ' ' + volume + ':'
@@ -127,9 +610,9 @@ def constructInCollEntry(bibItem, crossref):
             pass
     if crossref == '':
         crossref = '*' + retrieveBibField(bibItem, 'booktitle') + '*'
-    entry = author + ' (' + year + '). "' + \
-        retrieveBibField(bibItem, 'title') + '". In ' + crossref + ' ' + \
-        retrieveBibField(bibItem, 'pages') + '.'
+    title = retrieveBibField(bibItem, 'title')
+    entry = author + ' (' + year + '). "' + title + '". In ' + crossref + \
+        ' ' + retrieveBibField(bibItem, 'pages') + '.'
     doi = retrieveBibField(bibItem, 'Doi')
     if doi:
         entry += ' <http://doi.org/' + doi + '>'
@@ -138,44 +621,75 @@ def constructInCollEntry(bibItem, crossref):
         if url:
             entry += ' <' + url + '>'
     shortEntry = author[:author.find(',')] + '(' + year + '). "' + \
-        retrieveBibField(bibItem, 'title') + '". In ' + crossref + '.'
+        title + '". In ' + crossref + '.'
     return entry, shortEntry
 
 
+def replaceLatex(latexMatch, closers):
+    """Return markdown/unicode replacement for one match of LATEX_PATTERN.
+    `closers` is a stack of strings that close currently open groups."""
+    kind = latexMatch.lastgroup
+    if kind in ('braced', 'bare'):  # Accented letter
+        letter = latexMatch.group(kind).lstrip('\\')
+        return normalize('NFC', letter +
+                         LATEX_ACCENTS[latexMatch.group('accent')])
+    elif kind == 'open':
+        closers.append('')
+        return ''
+    elif kind == 'close':
+        return closers.pop() if closers else ''
+    elif kind == 'group':
+        delimiter = LATEX_GROUPS[latexMatch.group('group')]
+        closers.append(delimiter)
+        return delimiter
+    elif kind == 'letter':
+        return LATEX_LETTERS[latexMatch.group('letter')]
+    elif kind == 'ellipsis':
+        return '...'
+    elif kind == 'stray':  # Accent without a letter to go on
+        return ''
+    elif kind == 'command':  # Other command: drop it, keep its argument
+        return ''
+    else:  # Escaped character
+        return latexMatch.group('escaped')
+
+
 def removeLatex(text):
-    """Quick substitution of markdown for common LaTeX"""
-    text = sub(r'\\emph{([^}]*)}', r'*\1*', text)  # Swamp emphasis
-    text = sub(r'\\mkbibquote{([^}]*)}', r'"\1"', text)  # Remove mkbibquote
-    text = sub(r'{?\\ldots{?}?', '...', text)  # Replace `...`
-    text = sub(r"{\\'\\(.)}", r'\1', text)  # Replace latex accents
-    text = sub(r"\\['`\"^v]", '', text)  # Replace latex accents
-    text = sub(r'{(.)}', r'\1', text)  # Remove braces around single letters
-    text = text.replace('{}', '')  # Remove excess braces
-    text = text.replace("\\v", "")  # Remove 'v' accent
-    text = text.replace('\\&', '&')  # Don't escape `&`
-    return text
+    """Quick substitution of markdown for common LaTeX, in a single scan"""
+    if '\\' not in text and '{' not in text and '}' not in text:
+        return text
+    closers = []
+    return LATEX_PATTERN.sub(lambda latexMatch:
+                             replaceLatex(latexMatch, closers), text)
+
+
+def constructParentEntry(crossref):
+    """Return short markdown entry for crossref'd parent (e.g., the book,
+    collection, or proceedings containing an incollection). These are
+    memoized, since many entries may share one parent."""
+    parents = bibCache['parents']
+    if crossref not in parents:
+        parents[crossref] = crossref  # Fallback; also guards against cycles
+        parent = lookupBibEntry(crossref)
+        if parent:
+            nul1, nul2, parents[crossref] = constructBibEntry(parent)
+    return parents[crossref]
 
 
-def constructBibEntry(bibItem, bibDataList):
+def constructBibEntry(bibItem):
     """Create markdown bibliography entry for .bib entry"""
     # First extract relevant bibtex fields...
-    entryType = search(r'(?<=@)[^{]*', bibItem, IGNORECASE).group(0)
-    key = search(r'@[^{]*{([^,]*)', bibItem, IGNORECASE).group(1)
+    entryType = bibItem['type']
+    key = bibItem['key']
     # Now construct rough markdown representations of citation
-    if entryType == 'book':
+    if entryType in BOOK_TYPES:
         entry, shortEntry = constructBookEntry(bibItem)
     elif entryType == 'article':
         entry, shortEntry = constructArticleEntry(bibItem)
     elif entryType == 'incollection':
-        try:
-            crossref = search(r'(\s*crossref\s*=\s*{)(.*)}[,}]', bibItem,
-                              IGNORECASE).group(2)
-            for item in bibDataList:
-                if item.startswith('@book{' + crossref):
-                    nul1, nul2, crossref = constructBibEntry(item, bibDataList)
-                    break
-        except AttributeError:
-            crossref = ''
+        crossref = retrieveBibField(bibItem, 'crossref')
+        if crossref:
+            crossref = constructParentEntry(crossref)
         entry, shortEntry = constructInCollEntry(bibItem, crossref)
     else:  # Some other entry type; make it minimal....
         author = retrieveBibField(bibItem, 'author')
@@ -193,11 +707,10 @@ def constructBibEntry(bibItem, bibDataList):
     return key, entry, shortEntry
 
 
-def constructEntryDict(bibItem, bibDataList):
+def constructEntryDict(key, shortEntry):
     # Construct dictionary entry from full/short entry
-    key, entry, shortEntry = constructBibEntry(bibItem, bibDataList)
     entryDict = {'word': key}
-    entryDict['abbr'] = removeLatex(shortEntry)
+    entryDict['abbr'] = shortEntry
     # abbrLength = int(eval('s:abbrLength'))  # Length of key abbreviations
     # entryDict['abbr'] = key[:abbrLength]
     # entryDict['info'] = removeLatex(entry)
@@ -206,41 +719,112 @@ def constructEntryDict(bibItem, bibDataList):
     return entryDict
 
 
+def renderBibEntry(bibItem):
+    """Return (entry, shortEntry, completion dict) for .bib entry, using the
+    LRU cache of rendered entries when possible"""
+    parent = lookupBibEntry(retrieveBibField(bibItem, 'crossref'))
+    cacheKey = (bibItem['key'], bibItem['hash'],
+                parent['hash'] if parent else None)
+    cachedEntries = renderCache['entries']
+    rendered = cachedEntries.get(cacheKey)
+    if rendered:
+        cachedEntries.move_to_end(cacheKey)
+        return rendered
+    key, entry, shortEntry = constructBibEntry(bibItem)
+    rendered = entry, shortEntry, constructEntryDict(key, shortEntry)
+    cachedEntries[cacheKey] = rendered
+    if len(cachedEntries) > RENDER_CACHE_SIZE:
+        cachedEntries.popitem(last=False)
+    renderCache['unsaved'] += 1
+    if renderCache['unsaved'] >= RENDER_CACHE_SAVE:
+        saveRenderCache()
+    return rendered
+
+
 def constructOneEntry(bibKey):
-    bibDataList = getBibData()
-    bibItem = None
-    for item in bibDataList:
+    with bibLock:
+        getBibData()
         # Note: bibKey starts with '@', which needs to be removed
-        if '{' + bibKey[1:] + ',' in item:
-            bibItem = item
-            break
-    if bibItem:
-        key, entry, shortentry = constructBibEntry(bibItem, bibDataList)
-        return entry
-    else:
-        return ''
+        bibItem = lookupBibEntry(bibKey[1:])
+        if bibItem:
+            entry, shortEntry, entryDict = renderBibEntry(bibItem)
+            return entry
+        else:
+            return ''
 
 
-def createBibList(base):
-    """Create list of entries that match on every word in base"""
-    bibDataList = getBibData()
-    baseList = base.lower().split(' ')  # List of terms to match
-    matchedList = []  # List of matched bibliography items
-    for bibItem in bibDataList:
-        if bibItem.startswith('@comment{'):
-            pass
-        else:
-            keep = True
-            for baseItem in baseList:
-                if baseItem not in bibItem.lower():
-                    keep = False
-                    break
-            if keep:
-                matchedList.append(bibItem)
-    # Sort matchedList by citation key (`AuthorDATETitle`)
-    matchedList = sorted(matchedList,
-                         key=lambda item: match('@[^{]*{([^,]*)', item,
-                                                IGNORECASE).group(1))
-    constructedList = [constructEntryDict(item, bibDataList) for item in
-                       matchedList]
+def queryBibList(base, limit=0, fuzzy=0):
+    """Search entries currently in memory (without checking .bib files for
+    changes); see `createBibList`."""
+    bibDataList = bibCache['entries']
+    matches = findBibMatches(base, fuzzy)
+    if limit:
+        words = searchWords(base)
+
+        def rank(entryId):
+            if fuzzy:  # Fewer edits beat a better score
+                return -matches[entryId], scoreBibEntry(entryId, words)
+            return scoreBibEntry(entryId, words)
+        # Select best matches before formatting anything
+        matches = nlargest(int(limit), matches, key=rank)
+        matchedList = [bibDataList[entryId] for entryId in matches]
+    else:
+        matchedList = [bibDataList[entryId] for entryId in matches]
+        # Sort matchedList by citation key (`AuthorDATETitle`)
+        matchedList = sorted(matchedList, key=lambda item: item['key'])
+    constructedList = [renderBibEntry(item)[2] for item in matchedList]
     return constructedList
+
+
+def createBibList(base, limit=0, fuzzy=0):
+    """Create list of entries that match on every word in base. If `limit` is
+    given, return only the `limit` best matches (see `scoreBibEntry`), best
+    first; otherwise return all matches, sorted by key. If `fuzzy`, words
+    may be misspelled (see `findBibMatches`), and matches needing fewer
+    corrections are ranked first."""
+    with bibLock:
+        getBibData()
+        return queryBibList(base, limit, fuzzy)
+
+
+def runBibQuery(query, base, limit, fuzzy):
+    """Fill in results of background query: first from whatever is cached
+    on disk (possibly out of date), then from the current .bib files."""
+    with bibLock:
+        if bibCache['signature'] is None and loadBibCache():
+            query['words'] = queryBibList(base, limit, fuzzy)
+        getBibData()
+        query['words'] = queryBibList(base, limit, fuzzy)
+        query['done'] = 1
+
+
+def submitBibQuery(base, limit=0, fuzzy=0):
+    """Start search for entries matching base (as in `createBibList`) without
+    blocking. If the bibliography is already in memory, the search is done
+    at once; otherwise it runs in the background, and `pollBibQuery` gives
+    results as they become available. Returns dictionary with `id`, `done`,
+    and `words` (the results so far)."""
+    bibQueries.clear()  # Only the latest query is of interest
+    queryId = next(bibQueryIds)
+    query = {'id': queryId, 'done': 0, 'words': []}
+    if bibCache['signature'] is not None and bibLock.acquire(blocking=False):
+        try:
+            getBibData()
+            query['words'] = queryBibList(base, limit, fuzzy)
+            query['done'] = 1
+        finally:
+            bibLock.release()
+    else:
+        bibQueries[queryId] = query
+        Thread(target=runBibQuery, args=(query, base, limit, fuzzy),
+               daemon=True).start()
+    return dict(query)
+
+
+def pollBibQuery(queryId):
+    """Return state of background query (see `submitBibQuery`). Finished
+    queries are forgotten once polled."""
+    query = bibQueries.get(queryId, {'id': queryId, 'done': 1, 'words': []})
+    if query['done']:
+        bibQueries.pop(queryId, None)
+    return dict(query)